@@ -14,12 +14,16 @@ import torch
 from torch.nn import Module, LSTM, Linear
 from torch.utils.data import DataLoader, TensorDataset
 import numpy as np
+from src.instrument import traced, add_rows
+from src.modelIO import load_state, save_state
 
 
 class Net(Module):
     '''
     pytorch预测模型，包括LSTM时序预测层和Linear回归输出层
     可以根据自己的情况增加模型结构
+    多步预测(config.predict_days)时，一次前向同时输出所有horizon，output_size = label列数 * horizon数，
+    按horizon排列：[h1的所有label列, h2的所有label列, ...]，共用同一个LSTM
     '''
 
     def __init__(self, config):
@@ -33,6 +37,7 @@ class Net(Module):
         linear_out = self.linear(lstm_out)
         return linear_out, hidden
 
+@traced()
 def train(config, logger, train_and_valid_data):
     if config.do_train_visualized:
         import visdom
@@ -49,7 +54,7 @@ def train(config, logger, train_and_valid_data):
     model = Net(config).to(device)  # 如果是GPU训练， .to(device) 会把模型/数据复制到GPU显存中
 
     if config.add_train:  # 如果是增量训练，会先加载原模型参数
-        model.load_state_dict(torch.load(config.model_save_path + config.model_name))
+        model.load_state_dict(load_state(config.model_save_path + config.model_name, device))
 
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
     criterion = torch.nn.MSELoss()  # 这两句是定义优化器和loss
@@ -79,6 +84,7 @@ def train(config, logger, train_and_valid_data):
             optimizer.step()  # 用优化器更新参数
             train_loss_array.append(loss.item())
             global_step += 1
+            add_rows(_train_X.shape[0])
             if config.do_train_visualized and global_step % 100 == 0:  # 每一百步显示一次
                 vis.line(X=np.array([global_step]), Y=np.array([loss.item()]), win='Train_Loss',
                          update='append' if global_step > 0 else None, name='Train', opts=dict(showlegend=True))
@@ -104,7 +110,7 @@ def train(config, logger, train_and_valid_data):
         if valid_loss_cur < valid_loss_min:
             valid_loss_min = valid_loss_cur
             bad_epoch = 0
-            torch.save(model.state_dict(), config.model_save_path + config.model_name)  # 模型保存
+            save_state(model.state_dict(), config.model_save_path + config.model_name)  # 模型保存
         else:
             bad_epoch += 1
             if bad_epoch >= config.patience:  # 如果验证集指标连续patience个epoch没有提升，就停掉训练
@@ -112,16 +118,112 @@ def train(config, logger, train_and_valid_data):
                 break
 
 
+@traced()
+def train_fast(config, logger, train_and_valid_data):
+    '''
+    快速训练：数据一次性放到device上，每个epoch用打乱后的下标切batch，不经过DataLoader
+    loss留在device上累加，epoch结束才同步一次；最优参数保存在内存中，训练结束才写盘
+    '''
+    if config.do_train_visualized:
+        import visdom
+        vis = visdom.Visdom(env='model_pytorch')
+
+    device = torch.device("cuda:0" if config.use_cuda and torch.cuda.is_available() else "cpu")
+    train_X, train_Y, valid_X, valid_Y = [torch.from_numpy(d).float().to(device) for d in train_and_valid_data]
+    train_num, valid_num = train_X.shape[0], valid_X.shape[0]
+
+    model = Net(config).to(device)
+    if config.add_train:
+        model.load_state_dict(load_state(config.model_save_path + config.model_name, device))
+    run_model = model
+    if getattr(config, "use_compile", False) and hasattr(torch, "compile"):
+        run_model = torch.compile(model)
+
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
+    criterion = torch.nn.MSELoss()
+    generator = torch.Generator(device="cpu").manual_seed(config.random_seed)
+    valid_loss_min = float("inf")
+    best_state = None
+    bad_epoch = 0
+    global_step = 0
+
+    for epoch in range(config.epoch):
+        logger.info("Epoch {}/{}".format(epoch, config.epoch))
+
+        model.train()
+        if config.shuffle_train_data:
+            index = torch.randperm(train_num, generator=generator).to(device)
+        else:
+            index = torch.arange(train_num, device=device)
+        train_loss_sum = torch.zeros((), device=device)
+        hidden_train = None
+        for start in range(0, train_num, config.batch_size):
+            batch_index = index[start: start + config.batch_size]
+            _train_X, _train_Y = train_X[batch_index], train_Y[batch_index]
+            optimizer.zero_grad(set_to_none=True)
+            pred_Y, hidden_train = run_model(_train_X, hidden_train)
+            if not config.do_continue_train:
+                hidden_train = None
+            else:
+                hidden_train = tuple(h.detach() for h in hidden_train)  # 去掉梯度信息
+            loss = criterion(pred_Y, _train_Y)
+            loss.backward()
+            optimizer.step()
+            train_loss_sum += loss.detach() * batch_index.shape[0]
+            global_step += 1
+            add_rows(batch_index.shape[0])
+            if config.do_train_visualized and global_step % 100 == 0:
+                vis.line(X=np.array([global_step]), Y=np.array([loss.item()]), win='Train_Loss',
+                         update='append' if global_step > 0 else None, name='Train', opts=dict(showlegend=True))
+
+        model.eval()
+        with torch.no_grad():
+            if config.do_continue_train:  # 连续模式下验证也要按顺序传递hidden
+                valid_loss_sum = torch.zeros((), device=device)
+                hidden_valid = None
+                for start in range(0, valid_num, config.batch_size):
+                    pred_Y, hidden_valid = run_model(valid_X[start: start + config.batch_size], hidden_valid)
+                    valid_loss_sum += criterion(pred_Y, valid_Y[start: start + config.batch_size]) * \
+                                      valid_X[start: start + config.batch_size].shape[0]
+                valid_loss = valid_loss_sum / valid_num
+            else:
+                pred_Y, _ = run_model(valid_X)
+                valid_loss = criterion(pred_Y, valid_Y)
+        train_loss_cur = (train_loss_sum / train_num).item()
+        valid_loss_cur = valid_loss.item()
+        logger.info("The train loss is {:.6f}. ".format(train_loss_cur) +
+                    "The valid loss is {:.6f}.".format(valid_loss_cur))
+        if config.do_train_visualized:
+            vis.line(X=np.array([epoch]), Y=np.array([train_loss_cur]), win='Epoch_Loss',
+                     update='append' if epoch > 0 else None, name='Train', opts=dict(showlegend=True))
+            vis.line(X=np.array([epoch]), Y=np.array([valid_loss_cur]), win='Epoch_Loss',
+                     update='append' if epoch > 0 else None, name='Eval', opts=dict(showlegend=True))
+        if valid_loss_cur < valid_loss_min:
+            valid_loss_min = valid_loss_cur
+            bad_epoch = 0
+            best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        else:
+            bad_epoch += 1
+            if bad_epoch >= config.patience:
+                logger.info(" The training stops early in epoch {}".format(epoch))
+                break
+
+    if best_state is not None:
+        save_state(best_state, config.model_save_path + config.model_name)  # 只在训练结束时写一次
+
+
+@traced()
 def predict(config, test_X):
     # 获取测试数据
     print("before predict length" + str(len(test_X)))
+    add_rows(len(test_X))
     test_X = torch.from_numpy(test_X).float()
     test_set = TensorDataset(test_X)
     test_loader = DataLoader(test_set, batch_size=1)
     # 加载模型
     device = torch.device("cuda:0" if config.use_cuda and torch.cuda.is_available() else "cpu")
     model = Net(config).to(device)
-    model.load_state_dict(torch.load(config.model_save_path + config.model_name))  # 加载模型参数
+    model.load_state_dict(load_state(config.model_save_path + config.model_name, device))  # 加载模型参数
     # 先定义一个tensor保存预测结果
     result = torch.Tensor().to(device)
     # 预测过程
@@ -4,13 +4,13 @@ import os
 import sys
 import time
 import logging
-import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
+from src.evaluation import evaluate
+from src.featureStore import load_features
 
 frame = "pytorch"  # 可选： "keras", "pytorch", "tensorflow"
 
 if frame == "pytorch":
-    from src.LSTM_Model import train, predict
+    from src.LSTM_Model import train, train_fast, predict
 
 
 class Config:
@@ -19,8 +19,15 @@ class Config:
     label_columns = [2]  # 要预测的列，按原数据从0开始计算, 如同时预测第四，五列 最低价和最高价
     # label_in_feature_index = [feature_columns.index(i) for i in label_columns]  # 这样写不行
     label_in_feature_index = (lambda x, y: [x.index(i) for i in y])(feature_columns, label_columns)  # 因为feature不一定从0开始
+    # 按名字从 featureStore 生成特征，如 ['sentiment', 'price', 'price_ret_1', 'price_std_10', 'sentiment_ma_5']
+    # 设置后 feature_columns / label_columns 不再使用，输入输出维度由 Data 根据名字设置
+    feature_names = None
+    label_names = ['price']  # feature_names 中要预测的特征
 
     predict_day = 1  # 预测未来几天
+    # 多步预测：一个网络一次前向同时输出多个horizon，如 [1, 3, 5, 10]；设置后 predict_day 不再使用
+    # 输出按horizon排列：[h1的所有label列, h2的所有label列, ...]，output_size 由 Data 设置
+    predict_days = None
 
     # 网络参数
     input_size = len(feature_columns)
@@ -37,6 +44,8 @@ class Config:
     add_train = False  # 是否载入已有模型参数进行增量训练
     shuffle_train_data = True  # 是否对训练数据做shuffle
     use_cuda = False  # 是否使用GPU训练
+    fast_train = True  # 使用 train_fast：不经过DataLoader，loss留在device上，只在结束时保存最优模型
+    use_compile = False  # 是否用 torch.compile 编译模型，需要 pytorch 2.0 以上
 
     train_data_rate = 0.95  # 训练数据占总体数据比例，测试数据就是 1-train_data_rate
     valid_data_rate = 0.15  # 验证数据占训练数据比例，验证集在训练过程使用，为了做模型和参数选择
@@ -70,20 +79,42 @@ class Config:
     log_save_path = "./log/"
     do_log_save = True  # 是否将config和训练过程记录到log
     do_figure_save = True
+    save_stream_state = True  # 保存增量预测的hidden state快照，路径见 get_stream_state_path，和模型一一对应
     do_train_visualized = False  # 训练loss可视化，pytorch用visdom，tf用tensorboardX，实际上可以通用, keras没有
-    if not os.path.exists(model_save_path):
-        os.makedirs(model_save_path)  # makedirs 递归创建目录
-    if not os.path.exists(figure_save_path):
-        os.mkdir(figure_save_path)
-    if do_train and (do_log_save or do_train_visualized):
+
+
+def prepare_dirs(config):
+    # 运行时才创建目录，import 本模块不会有副作用
+    os.makedirs(config.model_save_path, exist_ok=True)  # makedirs 递归创建目录
+    os.makedirs(config.figure_save_path, exist_ok=True)
+    if config.do_train and (config.do_log_save or config.do_train_visualized):
         cur_time = time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime())
-        log_save_path = log_save_path + cur_time + '_' + used_frame + "/"
-        os.makedirs(log_save_path)
+        config.log_save_path = config.log_save_path + cur_time + '_' + config.used_frame + "/"
+        os.makedirs(config.log_save_path, exist_ok=True)
+
+
+def get_stream_state_path(config):
+    return config.model_save_path + "stream_" + config.model_name
+
+
+def get_horizons(config):
+    return list(config.predict_days) if config.predict_days else [config.predict_day]
+
+
+def set_model_sizes(config):
+    # 网络的输入输出维度由 feature_names / predict_days 决定，Data 和 LSTM_stream 都用这里的结果
+    if config.feature_names:
+        config.input_size = len(config.feature_names)
+        config.label_in_feature_index = [config.feature_names.index(name) for name in config.label_names]
+    config.output_size = len(config.label_in_feature_index) * len(get_horizons(config))
+    return config
 
 
 class Data:
     def __init__(self, config):
         self.config = config
+        set_model_sizes(config)
+        self.horizons = get_horizons(config)
         self.data, self.data_column_name = self.read_data()
 
         self.data_num = self.data.shape[0]
@@ -96,6 +127,11 @@ class Data:
         self.start_num_in_test = 0  # 测试集中前几天的数据会被删掉，因为它不够一个time_step
 
     def read_data(self):  # 读取初始数据
+        if self.config.feature_names:  # 滚动/滞后等特征，按源文件hash和特征列表缓存
+            values, names = load_features(self.config.train_data_path, self.config.feature_names)
+            if self.config.debug_mode:
+                values = values[:self.config.debug_num]
+            return values, names
         if self.config.debug_mode:
             init_data = pd.read_csv(self.config.train_data_path, nrows=self.config.debug_num,
                                     usecols=self.config.feature_columns)
@@ -104,14 +140,16 @@ class Data:
         return init_data.values, init_data.columns.tolist()  # .columns.tolist() 是获取列名
 
     def get_train_and_valid_data(self):
-        feature_data = self.norm_data[:self.train_num]
-        label_data = self.norm_data[self.config.predict_day: self.config.predict_day + self.train_num,
-                     self.config.label_in_feature_index]  # 将延后几天的数据作为label
+        # 最远的horizon也要有label，训练数据不够时截短
+        train_num = min(self.train_num, self.data_num - max(self.horizons))
+        feature_data = self.norm_data[:train_num]
+        label_data = np.concatenate([self.norm_data[h: h + train_num, self.config.label_in_feature_index]
+                                     for h in self.horizons], axis=1)  # 将延后几天的数据作为label，每个horizon一组
 
         if not self.config.do_continue_train:
             # 在非连续训练模式下，每time_step行数据会作为一个样本，两个样本错开一行，比如：1-20行，2-21行。。。。
-            train_x = [feature_data[i:i + self.config.time_step] for i in range(self.train_num - self.config.time_step)]
-            train_y = [label_data[i:i + self.config.time_step] for i in range(self.train_num - self.config.time_step)]
+            train_x = [feature_data[i:i + self.config.time_step] for i in range(train_num - self.config.time_step)]
+            train_y = [label_data[i:i + self.config.time_step] for i in range(train_num - self.config.time_step)]
         else:
             # 在连续训练模式下，每time_step行数据会作为一个样本，两个样本错开time_step行，
             # 比如：1-20行，21-40行。。。到数据末尾，然后又是 2-21行，22-41行。。。到数据末尾，……
@@ -120,14 +158,16 @@ class Data:
             train_x = [
                 feature_data[start_index + i * self.config.time_step: start_index + (i + 1) * self.config.time_step]
                 for start_index in range(self.config.time_step)
-                for i in range((self.train_num - start_index) // self.config.time_step)]
+                for i in range((train_num - start_index) // self.config.time_step)]
             train_y = [
                 label_data[start_index + i * self.config.time_step: start_index + (i + 1) * self.config.time_step]
                 for start_index in range(self.config.time_step)
-                for i in range((self.train_num - start_index) // self.config.time_step)]
+                for i in range((train_num - start_index) // self.config.time_step)]
 
         train_x, train_y = np.array(train_x), np.array(train_y)
 
+        from sklearn.model_selection import train_test_split
+
         train_x, valid_x, train_y, valid_y = train_test_split(train_x, train_y, test_size=self.config.valid_data_rate,
                                                               random_state=self.config.random_seed,
                                                               shuffle=self.config.shuffle_train_data)  # 划分训练和验证集，并打乱
@@ -186,12 +226,14 @@ def load_logger(config):
 def draw(config: Config, origin_data: Data, logger, predict_norm_data: np.ndarray):
     label_data = origin_data.data[int(origin_data.data_num * 0.15) + origin_data.start_num_in_test:,
                  config.label_in_feature_index]
-    predict_data = predict_norm_data * origin_data.std[config.label_in_feature_index] + \
-                   origin_data.mean[config.label_in_feature_index]  # 通过保存的均值和方差还原数据
+    horizons = get_horizons(config)
+    label_index = list(config.label_in_feature_index) * len(horizons)  # 每个horizon一组label列
+    predict_data = predict_norm_data * origin_data.std[label_index] + \
+                   origin_data.mean[label_index]  # 通过保存的均值和方差还原数据
     assert label_data.shape[0] == predict_data.shape[0], "The element number in origin and predicted data is different"
     print(label_data.shape[0])
     label_name = [origin_data.data_column_name[i] for i in config.label_in_feature_index]
-    label_column_num = len(config.label_columns)
+    label_column_num = len(config.label_in_feature_index)
 
     # label 和 predict 是错开config.predict_day天的数据的
     # 下面是两种norm后的loss的计算方式，结果是一样的，可以简单手推一下
@@ -200,36 +242,32 @@ def draw(config: Config, origin_data: Data, logger, predict_norm_data: np.ndarra
     # loss_norm = np.mean((label_norm_data[config.predict_day:] - predict_norm_data[:-config.predict_day]) ** 2, axis=0)
     # logger.info("The mean squared error of stock {} is ".format(label_name) + str(loss_norm))
 
-    loss = np.mean((label_data[config.predict_day:] - predict_data[:-config.predict_day]) ** 2, axis=0)
-    loss_norm = loss / (origin_data.std[config.label_in_feature_index] ** 2)
-    logger.info("The mean squared error of stock {} is ".format(label_name) + str(loss_norm))
     # label_X = range(origin_data.data_num - int(origin_data.data_num * 0.15) - origin_data.start_num_in_test)
     label_X = range(origin_data.data_num - int(origin_data.data_num * 0.15) - origin_data.start_num_in_test)
     predict_X = [x + config.predict_day for x in label_X]
-    TP = FP = FN = TN = 0
-
-    for i in range(label_column_num):
-        logger.info("The predicted stock {} for the next {} day(s) is: ".format(label_name[i], config.predict_day) +
-                    str(np.squeeze(predict_data[-config.predict_day:, i])))
-        origin_data = label_data[:, i]
-        prediction_data = predict_data[:, i]
-    for i in range(len(origin_data) - 1):
-        if origin_data[i + 1] >= origin_data[i] and prediction_data[i + 1] >= prediction_data[i]:
-            TP = TP + 1
-        if origin_data[i + 1] < origin_data[i] and prediction_data[i + 1] < prediction_data[i]:
-            TN = TN + 1
-        if origin_data[i + 1] >= origin_data[i] and prediction_data[i + 1] < prediction_data[i]:
-            FN = FN + 1
-        if origin_data[i + 1] < origin_data[i] and prediction_data[i + 1] >= prediction_data[i]:
-            FP = FP + 1
-    print("                 predict positive       predict negative")
-    print("real positive    " + str(TP) + "     |    " + str(FN))
-    print("real negative    " + str(FP) + "     |    " + str(TN))
-    Pre = TP / (TP + FP)
-    Re = TP / (TP + FN)
-    f1 = Pre * Re / (2 * (Pre + Re))
-    print("Precision is : " + str(Pre))
-    print("F1 score is : " + str(f1))
+
+    # 每个horizon单独评估，单步预测时只有 predict_day 一组
+    horizon_metrics = {}
+    for j, day in enumerate(horizons):
+        horizon_data = predict_data[:, j * label_column_num: (j + 1) * label_column_num]
+        # horizon_data[t] 预测的是 label_data[t + day]，错开day天对齐后再评估，MSE和方向指标都用这一份结果
+        metrics = evaluate(label_data[day:], horizon_data[:-day])
+        loss_norm = metrics["mse"] / (origin_data.std[config.label_in_feature_index] ** 2)
+        logger.info("The mean squared error of stock {} at horizon {} is ".format(label_name, day) + str(loss_norm))
+
+        for i in range(label_column_num):
+            logger.info("The predicted stock {} for the next {} day(s) is: ".format(label_name[i], day) +
+                        str(np.squeeze(horizon_data[-day:, i])))
+
+        for i in range(label_column_num):
+            logger.info("Direction of stock {} at horizon {}:\n".format(label_name[i], day) +
+                        "                 predict positive       predict negative\n" +
+                        "real positive    " + str(metrics["TP"][i]) + "     |    " + str(metrics["FN"][i]) + "\n" +
+                        "real negative    " + str(metrics["FP"][i]) + "     |    " + str(metrics["TN"][i]))
+            logger.info("Precision is : {:.4f}, Recall is : {:.4f}, F1 score is : {:.4f}, Hit rate is : {:.4f}".format(
+                metrics["precision"][i], metrics["recall"][i], metrics["f1"][i], metrics["hit_rate"][i]))
+        horizon_metrics[day] = metrics
+    return horizon_metrics if config.predict_days else horizon_metrics[config.predict_day]
 
 
 '''
@@ -254,6 +292,9 @@ def draw(config: Config, origin_data: Data, logger, predict_norm_data: np.ndarra
 
 
 def main(config):
+    prepare_dirs(config)
+    set_model_sizes(config)  # 在 load_logger 把config写进log之前，记录的才是实际的输入输出维度
+    handlers_before = list(logging.getLogger().handlers)
     logger = load_logger(config)
     try:
         np.random.seed(config.random_seed)  # 设置随机种子，保证可复现
@@ -261,14 +302,28 @@ def main(config):
 
         if config.do_train:
             train_X, valid_X, train_Y, valid_Y = data_gainer.get_train_and_valid_data()
-            train(config, logger, [train_X, train_Y, valid_X, valid_Y])
+            train_func = train_fast if config.fast_train else train
+            train_func(config, logger, [train_X, train_Y, valid_X, valid_Y])
 
         if config.do_predict:
             test_X, test_Y = data_gainer.get_test_data(return_label_data=True)
             pred_result = predict(config, test_X)  # 这里输出的是未还原的归一化预测数据
             draw(config, data_gainer, logger, pred_result)
+
+        if config.save_stream_state:  # 用全部历史数据预热hidden state，之后可用 LSTM_stream 逐日增量预测
+            from src.LSTM_stream import StreamForecaster
+            forecaster = StreamForecaster.from_data(config, data_gainer)
+            forecaster.snapshot(get_stream_state_path(config))
+            logger.info("Stream forecaster state saved to {}".format(get_stream_state_path(config)))
     except Exception:
         logger.error("Run Error", exc_info=True)
+        raise  # 记录到log后继续抛出，调用方（如 pipeline）才能知道这次运行失败了
+    finally:
+        # 去掉本次 load_logger 加到 root logger 上的handler，同一进程里多次调用 main 时日志不会重复或写进上一次的out.log
+        for handler in list(logging.getLogger().handlers):
+            if handler not in handlers_before:
+                logging.getLogger().removeHandler(handler)
+                handler.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+# -*- coding: UTF-8 -*-
+
+"""
+增量（流式）预测
+训练好的 Net 只加载一次，保存 LSTM 的 (h, c) 和归一化用的均值方差，
+每来一天新的 sentiment / price 数据就只前向一个 time step，得到下一次的预测值
+状态可以保存到磁盘并恢复，日终预测不需要重跑整个 Data + predict 流程
+设置了 config.feature_names 时，每天只需输入原始列（如 sentiment, price），
+滚动/滞后特征由保存的最近几天原始数据计算，见 featureStore.compute_last
+快照和模型一一对应（LSTM_regression.get_stream_state_path），恢复时会检查 model_name
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import torch
+
+from src.LSTM_Model import Net
+from src.LSTM_regression import set_model_sizes
+from src.modelIO import load_state
+from src import featureStore
+
+CONFIG_KEYS = ['input_size', 'output_size', 'label_in_feature_index', 'feature_names']
+
+
+class StreamForecaster:
+
+    def __init__(self, config, mean, std):
+        self.config = set_model_sizes(config)
+        self.device = torch.device("cuda:0" if config.use_cuda and torch.cuda.is_available() else "cpu")
+        self.model = Net(config).to(self.device)
+        self.model.load_state_dict(load_state(config.model_save_path + config.model_name, self.device))
+        self.model.eval()
+
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        # 多步预测时输出按horizon排列，每个horizon一组label列
+        self.label_index = list(config.label_in_feature_index) * (config.output_size // len(config.label_in_feature_index))
+        self.hidden = None
+        self.steps = 0  # 已经输入的天数
+
+        # 派生特征需要最近几天的原始列
+        self.raw_columns = featureStore.raw_columns(config.feature_names) if config.feature_names else None
+        self.raw_history = deque(maxlen=featureStore.history_length(config.feature_names)) \
+            if config.feature_names else None
+
+    @classmethod
+    def from_data(cls, config, data, warm_up=True):
+        """Build from a `Data` object, optionally replaying its history to initialise the hidden state."""
+        forecaster = cls(config, data.mean, data.std)
+        if warm_up:
+            forecaster.warm_up(data.data)
+        if forecaster.raw_columns:  # 原始列的最近几天接在 Data 的最后一行后面
+            raw = pd.read_csv(config.train_data_path, usecols=forecaster.raw_columns)[forecaster.raw_columns]
+            forecaster.raw_history.extend(raw.to_numpy(dtype=np.float64)[-forecaster.raw_history.maxlen:].tolist())
+        return forecaster
+
+    def _normalize(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.config.input_size)
+        return (rows - self.mean) / self.std
+
+    def _denormalize(self, pred_norm):
+        return pred_norm * self.std[self.label_index] + self.mean[self.label_index]
+
+    @torch.no_grad()
+    def _forward(self, norm_rows):
+        x = torch.from_numpy(norm_rows).float().unsqueeze(0).to(self.device)  # [1, time, input_size]
+        pred, self.hidden = self.model(x, self.hidden)
+        self.steps += norm_rows.shape[0]
+        return pred[0, -1].cpu().numpy()
+
+    def warm_up(self, history):
+        """Feed raw historical feature rows in one pass; returns the prediction after the last row."""
+        return self._denormalize(self._forward(self._normalize(history)))
+
+    def _engineer(self, raw_row):
+        if isinstance(raw_row, dict):
+            raw_row = [raw_row[column] for column in self.raw_columns]
+        raw_row = [float(value) for value in raw_row]
+        if len(raw_row) != len(self.raw_columns):
+            raise ValueError("Expected raw values for {}, got {}".format(self.raw_columns, raw_row))
+        self.raw_history.append(raw_row)
+        raw = pd.DataFrame(list(self.raw_history), columns=self.raw_columns)
+        return featureStore.compute_last(raw, self.config.feature_names)
+
+    def update(self, feature_row):
+        """
+        feature_row: 新一天的原始值
+            没有 feature_names 时，顺序与 config.feature_columns 相同，如 [sentiment, price]
+            有 feature_names 时，是 self.raw_columns 这几列的原始值（list 或 {列名: 值}），派生特征在这里计算
+        返回 predict_day 天后的（反归一化）预测值；原始数据还不够算出全部特征时（和训练时丢掉的行一样）返回 None
+        """
+        if self.raw_columns:
+            feature_row = self._engineer(feature_row)
+            if np.isnan(feature_row).any():
+                return None
+        return self._denormalize(self._forward(self._normalize(feature_row)))
+
+    def reset(self):
+        self.hidden = None
+        self.steps = 0
+        if self.raw_history is not None:
+            self.raw_history.clear()
+
+    def snapshot(self, path):
+        hidden = None if self.hidden is None else tuple(h.cpu() for h in self.hidden)
+        state = {'hidden': hidden, 'mean': self.mean.tolist(), 'std': self.std.tolist(), 'steps': self.steps,
+                 'model_name': self.config.model_name,
+                 'raw_history': None if self.raw_history is None else list(self.raw_history)}
+        state.update({key: getattr(self.config, key) for key in CONFIG_KEYS})
+        torch.save(state, path)
+
+    @classmethod
+    def restore(cls, config, path):
+        state = torch.load(path, map_location='cpu')
+        if state['model_name'] != config.model_name:
+            raise ValueError("Snapshot {} belongs to model {}, not {}".format(path, state['model_name'], config.model_name))
+        set_model_sizes(config)
+        # 快照里记录了网络的输入输出维度和特征，config 的 feature_names / predict_days 和训练时不一致就直接报错
+        for key in CONFIG_KEYS:
+            if key in state and list(np.atleast_1d(state[key])) != list(np.atleast_1d(getattr(config, key))):
+                raise ValueError("Config {} is {}, but the snapshot {} was saved with {}".format(
+                    key, getattr(config, key), path, state[key]))
+        forecaster = cls(config, state['mean'], state['std'])
+        if state['hidden'] is not None:
+            forecaster.hidden = tuple(h.to(forecaster.device) for h in state['hidden'])
+        forecaster.steps = state['steps']
+        if forecaster.raw_history is not None and state.get('raw_history'):
+            forecaster.raw_history.extend(state['raw_history'])
+        return forecaster
@@ -0,0 +1,58 @@
+"""
+Cold-start benchmark for the pipeline scripts.
+
+Each module is imported in a fresh interpreter, `--repeat` times, and the
+median wall time is reported. With `--checkpoint`, the time to load it
+eagerly (`torch.load`) and through `modelIO.load_state` (mmap / safetensors)
+is compared the same way.
+
+    python -m src.bench_startup
+    python -m src.bench_startup --checkpoint ../dataset/checkpoint-30000
+"""
+
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+MODULES = ['src.preprocess', 'src.sentimentClassification', 'src.dailyDataProcessing', 'src.LSTM_Model',
+           'src.LSTM_regression', 'src.LSTM_stream', 'src.pipeline']
+
+
+def time_subprocess(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None, result.stderr.decode('utf-8', 'replace').strip().splitlines()[-1]
+    return statistics.median(timings), None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", default=5, type=int, help="Runs per measurement; the median is reported.")
+    parser.add_argument("--checkpoint", default=None, type=str, help="Checkpoint to time eager vs mmap loading.")
+    args = parser.parse_args()
+
+    baseline, _ = time_subprocess('pass', args.repeat)
+    print('{:<40} {:>10}'.format('interpreter only', '{:.3f}s'.format(baseline)))
+    for module in MODULES:
+        elapsed, error = time_subprocess('import ' + module, args.repeat)
+        if error:
+            print('{:<40} {:>10}  ({})'.format('import ' + module, 'failed', error))
+        else:
+            print('{:<40} {:>10}'.format('import ' + module, '{:.3f}s'.format(elapsed)))
+
+    if args.checkpoint:
+        path = repr(args.checkpoint)
+        for label, code in [('torch.load (eager)', "import torch; torch.load({}, map_location='cpu')".format(path)),
+                            ('modelIO.load_state (mmap)', "from src.modelIO import load_state; load_state({})".format(path))]:
+            elapsed, error = time_subprocess(code, args.repeat)
+            print('{:<40} {:>10}'.format(label, 'failed' if error else '{:.3f}s'.format(elapsed)))
+
+
+if __name__ == "__main__":
+    main()
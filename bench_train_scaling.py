@@ -0,0 +1,53 @@
+"""
+Throughput scaling of data-parallel CPU training for BertForSmooth.
+
+Trains for `--benchmark_steps` optimizer steps with 1, 2, 4 and 8 local
+gloo workers and reports examples/s and the speedup over one worker. Any
+`sentimentClassification` option (batch size, model dir, ...) can be passed.
+
+    python -m src.bench_train_scaling --benchmark_steps 50 --train_batch_size 16
+"""
+
+import os
+import copy
+import json
+import tempfile
+
+import torch
+
+from src import sentimentClassification as sc
+
+
+def main():
+    parser = sc.build_parser()
+    parser.add_argument("--workers", default='1,2,4,8', type=str, help="Comma separated worker counts to try.")
+    args = parser.parse_args()
+    args.do_predict = False
+    if not args.benchmark_steps:
+        args.benchmark_steps = 50
+
+    results = []
+    for world_size in [int(w) for w in args.workers.split(',')]:
+        run_args = copy.copy(args)
+        run_args.world_size = world_size
+        run_args.dist_port = args.dist_port + world_size  # 每次用不同端口，避免上一轮端口未释放
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_args.throughput_file = os.path.join(tmp_dir, 'throughput.json')
+            if world_size > 1:
+                torch.multiprocessing.spawn(sc.train_worker, args=(run_args,), nprocs=world_size)
+            else:
+                model, tokenizer, global_step, max_seq_length, lower_case = sc.load_model(run_args)
+                sc.train(run_args, model, tokenizer, global_step, max_seq_length, lower_case, torch.device("cpu"))
+            with open(run_args.throughput_file, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+
+    base = results[0]['examples_per_sec']
+    print('{:>8} {:>14} {:>9} {:>11}'.format('workers', 'examples/s', 'speedup', 'efficiency'))
+    for result in results:
+        speedup = result['examples_per_sec'] / base
+        print('{:>8} {:>14.2f} {:>8.2f}x {:>10.0%}'.format(result['world_size'], result['examples_per_sec'], speedup,
+                                                            speedup / result['world_size'] * results[0]['world_size']))
+
+
+if __name__ == "__main__":
+    main()
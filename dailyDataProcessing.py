@@ -1,44 +1,41 @@
 import pandas as pd
 from pandas.tseries.offsets import Day, MonthEnd
 import numpy as np
-import matplotlib.pyplot as plt
 import scipy.stats as stats
 import fnmatch
 import os
+from src.instrument import traced, add_rows
+from src.priceStore import PriceStore
+from src.sentimentAggregation import load_classification_result, aggregate
 
 
 def prepare_stock_info(type):
-    currentFile = '../dataset/' + type + '-price.csv'
-    stock_file = pd.read_csv(currentFile, encoding='utf-8')
-    stock_file.drop(columns=["Close", "High", "Low", "Amount", "Rate"], inplace=True)
-    stock_file["Date"] = pd.to_datetime(
-        stock_file["Date"].apply(lambda x: x.replace('年', '/').replace('月', '/').replace('日', '')))
-    if '恒生' in type:
-        stock_file["Open"] = stock_file["Open"].str.replace(',', '').astype(float)
-    return stock_file
+    # 价格文件只解析一次，之后从 ../dataset/.price_cache 中的二进制缓存读取
+    return PriceStore.load(type).to_frame(["Open"])
 
 
+@traced()
 def compute_daily_sentimentValue(type, user_group):
-    currentFile = '../dataset/ClassificationResult-' + type + '-' + user_group + '.csv'
-    df = pd.read_csv(currentFile)
-    df.drop(columns=['ID', 'Text'], inplace=True)
-    daily_sentiment = df.groupby('Date').mean().reset_index()
-    delet_list = daily_sentiment[daily_sentiment['Date'].str.len() > 10].index.tolist()
-    daily_sentiment.drop(index=delet_list, inplace=True)
-    daily_sentiment['Date'] = pd.to_datetime(daily_sentiment['Date'])
+    df = load_classification_result(type, user_group)
+    add_rows(df.shape[0])
+    # 小时/5分钟粒度见 sentimentAggregation.aggregate_file
+    daily_sentiment = aggregate(df['Time'].values, df['Expected'].values, ['1D'])['1D']
     # daily_sentiment.to_csv('../dataset/daily_sentiment_mean.csv', index=False)
 
     return daily_sentiment
 
 
+@traced()
 def compute_T_value(daily_sentiment_dataframe, stock_dataframe, type , user_group):
     merged = pd.merge(daily_sentiment_dataframe, stock_dataframe, how='inner', on=['Date'])
+    add_rows(merged.shape[0])
     # spearman = merged.corr(method='spearman')
     # print("spearman: ")
     # print(spearman)
     senti = merged['Expected'].values.tolist()
     price = merged['Open'].values.tolist()
     date = merged['Date'].tolist()
+    count = merged['count'].values.tolist() if 'count' in merged.columns else None
     biggest_T = 0
     biggest_P = 0.00
     p_list=[]
@@ -56,20 +53,26 @@ def compute_T_value(daily_sentiment_dataframe, stock_dataframe, type , user_grou
             biggest_T = t
     print(p_list)
     dataframe = pd.DataFrame({'date': date[:len(date) - t], 'sentiment': senti[t:], 'price': price[:len(price) - t]})
+    if count is not None:  # 发帖量，与 sentiment 同样错开t天，作为第4列供 featureStore 使用
+        dataframe['count'] = count[t:]
     sentiment_file_after = '../dataset/sentimentDaily-' + type + user_group + '.csv'
     dataframe.to_csv(sentiment_file_after, index=False, sep=',')
     return biggest_T, biggest_P
 
 
+def process_group(type, user_group):
+    spd = compute_daily_sentimentValue(type, user_group)
+    ppd = prepare_stock_info(type)
+    return compute_T_value(spd, ppd, type, user_group)
+
+
 def main():
     patten = '*-weibo.csv'
     weibo_file_list = fnmatch.filter(os.listdir('../dataset'), patten)
     for eachFile in weibo_file_list:
         for user_group in ['normal', 'expert']:
             type = eachFile.replace('-weibo.csv', '')
-            spd = compute_daily_sentimentValue(type, user_group)
-            ppd = prepare_stock_info(type)
-            biggest_T, biggest_P = compute_T_value(spd, ppd, type,user_group)
+            biggest_T, biggest_P = process_group(type, user_group)
             print('for type: ' + type + user_group + ' ,the result is: ' + 'T = ' + str(biggest_T) + ', pearson = ' + str(biggest_P))
 
 
@@ -0,0 +1,125 @@
+"""
+Near-duplicate / repost collapsing before BERT classification.
+
+Weibo reposts usually differ only by `//@user:` chains, hashtags, URLs or
+mentions. Texts are normalized, exact normalized duplicates are merged, and
+the remaining texts are clustered with 64-bit SimHash over character 3-grams,
+using LSH banding to find candidate pairs. Only one representative per
+cluster needs to be classified; `fan_out` copies its result to every member.
+"""
+
+import re
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_URL = re.compile(r'https?://\S+|www\.\S+')
+_REPOST = re.compile(r'//\s*@[^:：\s]+[:：]?')
+_MENTION = re.compile(r'@[^\s:：,，]+')
+_HASHTAG = re.compile(r'#[^#]*#')
+_BOILERPLATE = re.compile(r'转发微博|轉發微博|repost')
+_NON_WORD = re.compile(r'[\W_]+')
+
+SIMHASH_BITS = 64
+BANDS = 4  # 汉明距离 <= BANDS - 1 的两个指纹至少有一个band完全相同
+_BIT_SHIFTS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+
+def normalize(text):
+    text = str(text).lower()
+    for pattern in (_URL, _REPOST, _MENTION, _HASHTAG, _BOILERPLATE, _NON_WORD):
+        text = pattern.sub('', text)
+    return text
+
+
+def simhash(text, ngram=3):
+    if len(text) <= ngram:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + ngram] for i in range(len(text) - ngram + 1)]
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for s in shingles], dtype=np.uint64)
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    weights = bits.sum(axis=0).astype(np.int64) * 2 - len(shingles)
+    return int(np.sum(np.uint64(1) << _BIT_SHIFTS[weights > 0], dtype=np.uint64))
+
+
+def _popcount(x):
+    return np.unpackbits(x.astype('>u8').view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class _UnionFind(object):
+
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def cluster(texts, max_distance=3):
+    """
+    Returns (representative_of, representatives): for every row the index of
+    the row whose prediction it reuses, and the sorted unique representatives.
+    """
+    if max_distance >= BANDS:
+        raise ValueError("max_distance must be smaller than the number of LSH bands ({})".format(BANDS))
+    keys = []
+    for text in texts:
+        normalized = normalize(text)
+        keys.append(normalized if normalized else str(text).strip())
+
+    # 第一步：规范化后完全相同的文本直接合并
+    first_row = {}
+    unique_rows = []
+    row_to_unique = np.empty(len(keys), dtype=np.int64)
+    for row, key in enumerate(keys):
+        if key not in first_row:
+            first_row[key] = len(unique_rows)
+            unique_rows.append(row)
+        row_to_unique[row] = first_row[key]
+
+    # 第二步：SimHash + LSH 分桶，只比较同桶的候选对
+    fingerprints = np.array([simhash(keys[row]) for row in unique_rows], dtype=np.uint64)
+    union_find = _UnionFind(len(unique_rows))
+    band_bits = SIMHASH_BITS // BANDS
+    mask = np.uint64((1 << band_bits) - 1)
+    for band in range(BANDS):
+        band_values = (fingerprints >> np.uint64(band * band_bits)) & mask
+        order = np.argsort(band_values, kind='stable')
+        sorted_values = band_values[order]
+        bounds = np.flatnonzero(np.diff(sorted_values)) + 1
+        for members in np.split(order, bounds):
+            for i in range(len(members) - 1):
+                distance = _popcount(fingerprints[members[i]] ^ fingerprints[members[i + 1:]])
+                for j in members[i + 1:][distance <= max_distance]:
+                    union_find.union(members[i], j)
+
+    roots = np.array([union_find.find(i) for i in range(len(unique_rows))], dtype=np.int64)
+    representative_of = np.asarray(unique_rows, dtype=np.int64)[roots[row_to_unique]]
+    representatives = np.unique(representative_of)
+    return representative_of, representatives
+
+
+def fan_out(representative_values, representative_of, representatives):
+    """Copies each representative's value to all members of its cluster."""
+    positions = np.searchsorted(representatives, representative_of)
+    return [representative_values[p] for p in positions]
+
+
+def report(total, representatives):
+    saved = total - len(representatives)
+    logger.info("dedup: %d posts -> %d clusters, %d inferences saved (%.1f%%)",
+                total, len(representatives), saved, 100.0 * saved / total if total else 0.0)
@@ -0,0 +1,182 @@
+"""
+Distils `BertForSmooth` into a small student for bulk sentiment scoring.
+
+The student reads the same `BertTokenizer` ids and is trained on the
+teacher's soft `class_probas` from `do_predict`. It has the same forward
+signature as `BertForSmooth`, so it plugs into `do_predict` /
+`predict_file` through `--model_type student --student_checkpoint <path>`.
+
+    python -m src.distillation --student_type cnn --output ../models/student-cnn.pt
+"""
+
+import os
+import time
+import fnmatch
+import logging
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, SequentialSampler
+
+logger = logging.getLogger(__name__)
+
+
+class StudentCNN(torch.nn.Module):
+    """Embedding + multi-width 1D convolutions + max pooling."""
+
+    def __init__(self, vocab_size, num_labels, embedding_dim=128, num_filters=128, kernel_sizes=(2, 3, 4),
+                 dropout=0.2):
+        super(StudentCNN, self).__init__()
+        self.embedding = torch.nn.Embedding(vocab_size, embedding_dim, padding_idx=0)
+        self.convs = torch.nn.ModuleList([torch.nn.Conv1d(embedding_dim, num_filters, k, padding=k // 2)
+                                          for k in kernel_sizes])
+        self.dropout = torch.nn.Dropout(dropout)
+        self.classifier = torch.nn.Linear(num_filters * len(kernel_sizes), num_labels)
+
+    def forward(self, input_ids, segment_ids, input_mask, labels=None):
+        mask = input_mask.unsqueeze(1).float()
+        x = self.embedding(input_ids).transpose(1, 2)
+        # padding 位置置为很小的值，不参与 max pooling
+        pooled = [(torch.relu(conv(x))[:, :, :input_ids.shape[1]] * mask - (1 - mask) * 1e4).max(dim=2)[0]
+                  for conv in self.convs]
+        logits = self.classifier(self.dropout(torch.cat(pooled, dim=1)))
+        if labels is not None:
+            return torch.nn.functional.cross_entropy(logits, labels)
+        return logits
+
+
+class StudentBiLSTM(torch.nn.Module):
+    """Embedding + one bidirectional LSTM layer + masked mean pooling."""
+
+    def __init__(self, vocab_size, num_labels, embedding_dim=128, hidden_size=128, dropout=0.2):
+        super(StudentBiLSTM, self).__init__()
+        self.embedding = torch.nn.Embedding(vocab_size, embedding_dim, padding_idx=0)
+        self.lstm = torch.nn.LSTM(embedding_dim, hidden_size, batch_first=True, bidirectional=True)
+        self.dropout = torch.nn.Dropout(dropout)
+        self.classifier = torch.nn.Linear(hidden_size * 2, num_labels)
+
+    def forward(self, input_ids, segment_ids, input_mask, labels=None):
+        output, _ = self.lstm(self.embedding(input_ids))
+        mask = input_mask.unsqueeze(2).float()
+        pooled = (output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        logits = self.classifier(self.dropout(pooled))
+        if labels is not None:
+            return torch.nn.functional.cross_entropy(logits, labels)
+        return logits
+
+
+STUDENT_TYPES = {'cnn': StudentCNN, 'bilstm': StudentBiLSTM}
+
+
+def build_student(student_type, vocab_size, num_labels):
+    if student_type not in STUDENT_TYPES:
+        raise ValueError("Unknown student type: {}, should be one of {}".format(student_type, list(STUDENT_TYPES)))
+    return STUDENT_TYPES[student_type](vocab_size, num_labels)
+
+
+def distillation_loss(student_logits, teacher_probas, temperature=2.0):
+    """KL(teacher || student) on temperature-softened distributions, scaled by T^2."""
+    teacher_log = torch.log(teacher_probas.clamp(min=1e-8)) / temperature
+    teacher_soft = torch.softmax(teacher_log, dim=1)
+    student_log_soft = torch.log_softmax(student_logits / temperature, dim=1)
+    return torch.nn.functional.kl_div(student_log_soft, teacher_soft, reduction='batchmean') * temperature ** 2
+
+
+def train_student(student, tensors, teacher_probas, epochs=5, batch_size=256, learning_rate=1e-3, temperature=2.0,
+                  seed=42):
+    input_ids, input_mask, segment_ids = tensors
+    optimizer = torch.optim.Adam(student.parameters(), lr=learning_rate)
+    generator = torch.Generator().manual_seed(seed)
+    num = input_ids.shape[0]
+    for epoch in range(epochs):
+        student.train()
+        loss_sum = torch.zeros(())
+        permutation = torch.randperm(num, generator=generator)
+        for start in range(0, num, batch_size):
+            index = permutation[start: start + batch_size]
+            optimizer.zero_grad()
+            logits = student(input_ids[index], segment_ids[index], input_mask[index])
+            loss = distillation_loss(logits, teacher_probas[index], temperature)
+            loss.backward()
+            optimizer.step()
+            loss_sum += loss.detach() * index.shape[0]
+        logger.info("Student epoch %d/%d, distillation loss %.6f", epoch + 1, epochs, (loss_sum / num).item())
+    return student
+
+
+def save_student(path, student, student_type, vocab_size, num_labels, max_seq_length, lower_case):
+    torch.save({'student_type': student_type, 'vocab_size': vocab_size, 'num_labels': num_labels,
+                'model_state': student.state_dict(), 'max_seq_length': max_seq_length, 'lower_case': lower_case}, path)
+
+
+def load_student(path):
+    from src.modelIO import load_state
+    checkpoint = load_state(path)
+    student = build_student(checkpoint['student_type'], checkpoint['vocab_size'], checkpoint['num_labels'])
+    student.load_state_dict(checkpoint['model_state'])
+    return student, checkpoint['max_seq_length'], checkpoint['lower_case']
+
+
+def timed_predict(data, model, device, batch_size):
+    from src.sentimentClassification import do_predict
+    dataloader = DataLoader(data, sampler=SequentialSampler(data), batch_size=batch_size)
+    start = time.perf_counter()
+    predictions, class_probas = do_predict(dataloader, model, device)
+    elapsed = time.perf_counter() - start
+    return np.asarray(predictions), np.asarray(class_probas), len(data) / elapsed if elapsed > 0 else float('inf')
+
+
+def main():
+    from src import sentimentClassification as sc
+
+    parser = sc.build_parser()
+    parser.add_argument("--student_type", default='cnn', choices=sorted(STUDENT_TYPES), help="Student architecture.")
+    parser.add_argument("--output", default='../models/student.pt', type=str, help="Where to save the student.")
+    parser.add_argument("--distill_epochs", default=5, type=int)
+    parser.add_argument("--distill_batch_size", default=256, type=int)
+    parser.add_argument("--distill_learning_rate", default=1e-3, type=float)
+    parser.add_argument("--temperature", default=2.0, type=float)
+    parser.add_argument("--heldout_rate", default=0.1, type=float, help="Share of posts kept for the report.")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    teacher, tokenizer, _, max_seq_length, lower_case = sc.load_model(args)
+    teacher.to(device)
+
+    examples = []
+    for eachFile in fnmatch.filter(os.listdir(args.data_dir), '*-weibo.csv'):
+        examples.extend(sc.DataProcessor.get_test_examples(eachFile.replace('-weibo.csv', ''))[1])
+    features = sc.convert_examples_to_features(examples, max_seq_length, tokenizer, False)
+    data = sc.features_to_tensor(features)
+
+    rng = np.random.RandomState(args.seed)
+    order = rng.permutation(len(data))
+    heldout_num = max(1, int(len(data) * args.heldout_rate))
+    train_index, heldout_index = torch.from_numpy(order[heldout_num:]), torch.from_numpy(order[:heldout_num])
+    train_tensors = tuple(t[train_index] for t in data.tensors)
+    heldout_data = torch.utils.data.TensorDataset(*(t[heldout_index] for t in data.tensors))
+
+    # 老师模型的软标签
+    train_data = torch.utils.data.TensorDataset(*train_tensors)
+    _, teacher_probas, _ = timed_predict(train_data, teacher, device, args.predict_batch_size)
+    teacher_probas = torch.from_numpy(teacher_probas).float()
+
+    vocab_size = len(tokenizer.vocab)
+    num_labels = teacher_probas.shape[1]
+    student = build_student(args.student_type, vocab_size, num_labels)
+    train_student(student, train_tensors, teacher_probas, epochs=args.distill_epochs,
+                  batch_size=args.distill_batch_size, learning_rate=args.distill_learning_rate,
+                  temperature=args.temperature, seed=args.seed)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    save_student(args.output, student, args.student_type, vocab_size, num_labels, max_seq_length, lower_case)
+
+    teacher_predictions, _, teacher_speed = timed_predict(heldout_data, teacher, device, args.predict_batch_size)
+    student_predictions, _, student_speed = timed_predict(heldout_data, student, device, args.predict_batch_size)
+    agreement = float(np.mean(teacher_predictions == student_predictions))
+    logger.info("Held-out posts: %d", len(heldout_data))
+    logger.info("Agreement with teacher: %.4f", agreement)
+    logger.info("Throughput teacher: %.1f posts/s, student: %.1f posts/s (%.1fx)",
+                teacher_speed, student_speed, student_speed / teacher_speed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Memory-mapped store of pooled BERT representations, indexed by post ID.
+
+`BertForSmooth(..., return_pooled=True)` exposes the 768-d pooled output
+that `classifier` consumes; `do_predict(..., embedding_writer=...)` streams it
+into a store while classifying. New linear heads, label schemes or thresholds
+can then be fitted and evaluated on the store with plain matrix operations
+instead of re-running BERT.
+
+    <path>.npy          float16/float32 matrix, one row per encoded post (memory-mapped)
+    <path>.ids.npy      post ID of every row
+    <path>.labels.npy   gold labels, when the encoded examples had them
+    <path>.alias.npy    (post ID, row) pairs for posts that reuse another row (dedup)
+
+    python -m src.embeddingStore encode --split train --store ../dataset/embeddings/train
+    python -m src.embeddingStore fit --store ../dataset/embeddings/train --head ridge
+"""
+
+import os
+import argparse
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingWriter(object):
+    """Appends pooled batches to a raw file; `close` converts it into a store."""
+
+    def __init__(self, path, float16=True):
+        self.path = path
+        self.dtype = np.float16 if float16 else np.float32
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._raw = open(path + '.raw', 'wb')
+        self.rows = 0
+        self.dim = None
+
+    def append(self, pooled):
+        pooled = np.ascontiguousarray(pooled, dtype=self.dtype)
+        self.dim = pooled.shape[1]
+        self._raw.write(pooled.tobytes())
+        self.rows += pooled.shape[0]
+
+    def close(self, ids, labels=None, aliases=None):
+        self._raw.close()
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.shape[0] != self.rows:
+            raise ValueError("Got {} ids for {} encoded rows".format(ids.shape[0], self.rows))
+        raw = np.memmap(self.path + '.raw', dtype=self.dtype, mode='r', shape=(self.rows, self.dim or 0))
+        matrix = np.lib.format.open_memmap(self.path + '.npy', mode='w+', dtype=self.dtype, shape=raw.shape)
+        matrix[:] = raw
+        matrix.flush()
+        del raw, matrix
+        os.remove(self.path + '.raw')
+        np.save(self.path + '.ids.npy', ids)
+        if labels is not None:
+            np.save(self.path + '.labels.npy', np.asarray(labels, dtype=np.int64))
+        if aliases is not None:
+            np.save(self.path + '.alias.npy', np.asarray(aliases, dtype=np.int64).reshape(-1, 2))
+        logger.info("Wrote %d embeddings of dim %s to %s", self.rows, self.dim, self.path + '.npy')
+
+
+class EmbeddingStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.matrix = np.load(path + '.npy', mmap_mode='r')
+        self.ids = np.load(path + '.ids.npy')
+        self.labels = np.load(path + '.labels.npy') if os.path.exists(path + '.labels.npy') else None
+        row_of = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        if os.path.exists(path + '.alias.npy'):
+            for post_id, row in np.load(path + '.alias.npy').tolist():
+                row_of.setdefault(post_id, row)
+        self._row_of = row_of
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def rows(self, post_ids):
+        return np.array([self._row_of[post_id] for post_id in post_ids], dtype=np.int64)
+
+    def get(self, post_ids):
+        return np.asarray(self.matrix[self.rows(post_ids)], dtype=np.float32)
+
+    def chunks(self, rows=None, chunk_size=65536):
+        """Yields (row positions, float32 block) without loading the whole matrix."""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        for start in range(0, len(rows), chunk_size):
+            index = rows[start: start + chunk_size]
+            yield index, np.asarray(self.matrix[index], dtype=np.float32)
+
+
+def _with_bias(x):
+    return np.hstack([x, np.ones((x.shape[0], 1), dtype=x.dtype)])
+
+
+def fit_ridge_head(store, labels, num_labels, rows=None, l2=1.0):
+    """Closed-form ridge regression onto one-hot labels; returns (weight [dim, labels], bias [labels])."""
+    dim = store.matrix.shape[1]
+    gram = np.zeros((dim + 1, dim + 1))
+    cross = np.zeros((dim + 1, num_labels))
+    for index, block in store.chunks(rows):
+        x = _with_bias(block.astype(np.float64))
+        gram += x.T @ x
+        cross += x.T @ np.eye(num_labels)[labels[index]]
+    regularizer = l2 * np.eye(dim + 1)
+    regularizer[-1, -1] = 0  # 不约束 bias
+    solution = np.linalg.solve(gram + regularizer, cross)
+    return solution[:-1], solution[-1]
+
+
+def fit_softmax_head(store, labels, num_labels, rows=None, epochs=20, learning_rate=1e-2, weight_decay=1e-4,
+                     batch_size=256, seed=42):
+    """Multinomial logistic regression on the stored features, trained with Adam."""
+    import torch
+    rows = np.arange(len(store)) if rows is None else np.asarray(rows)
+    linear = torch.nn.Linear(store.matrix.shape[1], num_labels)
+    optimizer = torch.optim.Adam(linear.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    rng = np.random.RandomState(seed)
+    for _ in range(epochs):
+        for index, block in store.chunks(rng.permutation(rows), batch_size):
+            optimizer.zero_grad()
+            loss = torch.nn.functional.cross_entropy(linear(torch.from_numpy(block)), torch.from_numpy(labels[index]))
+            loss.backward()
+            optimizer.step()
+    return linear.weight.detach().numpy().T.copy(), linear.bias.detach().numpy().copy()
+
+
+def predict_head(store, weight, bias, rows=None):
+    scores = [block @ weight + bias for _, block in store.chunks(rows)]
+    return np.concatenate(scores) if scores else np.zeros((0, weight.shape[1]))
+
+
+def evaluate_head(store, weight, bias, labels, rows=None):
+    rows = np.arange(len(store)) if rows is None else np.asarray(rows)
+    predictions = np.argmax(predict_head(store, weight, bias, rows), axis=1)
+    gold = labels[rows]
+    classes = np.unique(np.concatenate([gold, predictions]))
+    tp = np.array([np.sum((predictions == c) & (gold == c)) for c in classes], dtype=float)
+    precision = np.divide(tp, [np.sum(predictions == c) for c in classes], out=np.zeros_like(tp), where=tp > 0)
+    recall = np.divide(tp, [np.sum(gold == c) for c in classes], out=np.zeros_like(tp), where=tp > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(tp), where=precision + recall > 0)
+    return {'accuracy': float(np.mean(predictions == gold)), 'macro_f1': float(np.mean(f1))}
+
+
+def encode(args):
+    import torch
+    from torch.utils.data import DataLoader, SequentialSampler
+    from src import sentimentClassification as sc
+
+    device = torch.device("cpu")
+    model, tokenizer, _, max_seq_length, _ = sc.load_model(args)
+    model.to(device)
+    if args.split == 'train':
+        examples = sc.DataProcessor.get_train_examples(args.data_dir)
+        ids, labels = list(range(len(examples))), [example.label for example in examples]
+    else:
+        ids, examples = sc.DataProcessor.get_test_examples(args.split)[:2]
+        labels = None
+    features = sc.convert_examples_to_features(examples, max_seq_length, tokenizer, False)
+    data = sc.features_to_tensor(features)
+    dataloader = DataLoader(data, sampler=SequentialSampler(data), batch_size=args.predict_batch_size)
+    writer = EmbeddingWriter(args.store, float16=not args.float32)
+    sc.do_predict(dataloader, model, device, embedding_writer=writer)
+    writer.close(ids, labels=labels)
+
+
+def fit(args):
+    store = EmbeddingStore(args.store)
+    if store.labels is None:
+        raise ValueError("Store {} has no labels to fit a head on".format(args.store))
+    num_labels = int(store.labels.max()) + 1
+    order = np.random.RandomState(args.seed).permutation(len(store))
+    heldout_num = int(len(store) * args.heldout_rate)
+    heldout_rows, train_rows = order[:heldout_num], order[heldout_num:]
+    if args.head == 'ridge':
+        weight, bias = fit_ridge_head(store, store.labels, num_labels, train_rows, l2=args.l2)
+    else:
+        weight, bias = fit_softmax_head(store, store.labels, num_labels, train_rows, epochs=args.epochs,
+                                        learning_rate=args.learning_rate, batch_size=args.batch_size)
+    logger.info("train: %s", evaluate_head(store, weight, bias, store.labels, train_rows))
+    if heldout_num:
+        logger.info("held-out: %s", evaluate_head(store, weight, bias, store.labels, heldout_rows))
+    if args.output:
+        np.savez(args.output, weight=weight, bias=bias)
+
+
+def main():
+    from src.sentimentClassification import build_parser
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+    encode_parser = commands.add_parser('encode', parents=[build_parser()], add_help=False,
+                                        help="Run BERT once and store pooled embeddings.")
+    encode_parser.add_argument("--split", default='train', type=str,
+                               help="'train' for sentiment.train, otherwise an index name for sentiment.test.<index>.")
+    encode_parser.add_argument("--store", required=True, type=str)
+    encode_parser.add_argument("--float32", default=False, action='store_true', help="Store float32 instead of float16.")
+    fit_parser = commands.add_parser('fit', help="Fit and evaluate a linear head on a store.")
+    fit_parser.add_argument("--store", required=True, type=str)
+    fit_parser.add_argument("--head", default='ridge', choices=['ridge', 'softmax'])
+    fit_parser.add_argument("--l2", default=1.0, type=float)
+    fit_parser.add_argument("--epochs", default=20, type=int)
+    fit_parser.add_argument("--learning_rate", default=1e-2, type=float, help="Adam learning rate of the softmax head.")
+    fit_parser.add_argument("--batch_size", default=256, type=int, help="Mini-batch size of the softmax head.")
+    fit_parser.add_argument("--heldout_rate", default=0.1, type=float)
+    fit_parser.add_argument("--seed", default=42, type=int)
+    fit_parser.add_argument("--output", default=None, type=str, help="Save the head as .npz (weight, bias).")
+    args = parser.parse_args()
+    if args.command == 'encode':
+        encode(args)
+    elif args.command == 'fit':
+        fit(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
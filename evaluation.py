@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+
+"""
+预测结果评估
+方向混淆矩阵、precision / recall / F1、hit rate、MSE / MAE 及其滚动窗口版本
+全部用 numpy 数组运算完成，第0维是时间，其余维度（label列、预测天数……）一次算完
+不涉及画图，批量评估大量 sweep / backtest 结果时开销很小
+"""
+
+import numpy as np
+
+
+def _safe_divide(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b != 0)
+
+
+def _rolling_sum(x, window):
+    # 用累加和实现滑动窗口求和，输出长度为 len(x) - window + 1
+    x = np.asarray(x, dtype=float)
+    if window < 1 or window > x.shape[0]:
+        raise ValueError("Invalid window: {}, should be in [1, {}]".format(window, x.shape[0]))
+    cumsum = np.cumsum(x, axis=0)
+    cumsum = np.concatenate([np.zeros((1,) + x.shape[1:]), cumsum], axis=0)
+    return cumsum[window:] - cumsum[:-window]
+
+
+def direction_flags(label, predict):
+    """Up/down flags of consecutive days; a non-negative change counts as up."""
+    label = np.asarray(label, dtype=float)
+    predict = np.asarray(predict, dtype=float)
+    assert label.shape == predict.shape, "The shape of label and predicted data is different"
+    real_up = np.diff(label, axis=0) >= 0
+    pred_up = np.diff(predict, axis=0) >= 0
+    return real_up, pred_up
+
+
+def confusion_flags(label, predict):
+    """Per-day TP / FP / FN / TN boolean arrays, shape (n - 1, ...)."""
+    real_up, pred_up = direction_flags(label, predict)
+    tp = real_up & pred_up
+    fp = ~real_up & pred_up
+    fn = real_up & ~pred_up
+    tn = ~real_up & ~pred_up
+    return tp, fp, fn, tn
+
+
+def confusion_matrix(label, predict):
+    """TP / FP / FN / TN counts for every trailing column at once."""
+    return tuple(flag.sum(axis=0) for flag in confusion_flags(label, predict))
+
+
+def scores_from_counts(tp, fp, fn, tn):
+    precision = _safe_divide(tp, tp + fp)
+    recall = _safe_divide(tp, tp + fn)
+    f1 = _safe_divide(2 * precision * recall, precision + recall)
+    hit_rate = _safe_divide(np.asarray(tp) + tn, np.asarray(tp) + fp + fn + tn)
+    return {"precision": precision, "recall": recall, "f1": f1, "hit_rate": hit_rate}
+
+
+def evaluate(label, predict):
+    """
+    label, predict: 对齐后的真实值和预测值，shape (n, ...)
+    这里不做任何错位：predict[t] 必须是对 label[t] 的预测。模型输出的第t行预测的是第 t + predict_day 天时，
+    调用方要先对齐，如 evaluate(label[predict_day:], predict[:-predict_day])，否则 mse / mae 和方向指标都没有意义
+    返回各指标，shape 为去掉时间维后的 (...)
+    """
+    label = np.asarray(label, dtype=float)
+    predict = np.asarray(predict, dtype=float)
+    tp, fp, fn, tn = confusion_matrix(label, predict)
+    result = {"TP": tp, "FP": fp, "FN": fn, "TN": tn}
+    result.update(scores_from_counts(tp, fp, fn, tn))
+    error = label - predict
+    result["mse"] = np.mean(error ** 2, axis=0)
+    result["mae"] = np.mean(np.abs(error), axis=0)
+    return result
+
+
+def rolling_evaluate(label, predict, window):
+    """
+    滚动窗口版本的 evaluate，方向指标的窗口包含 window 个相邻日变化，
+    误差指标的窗口包含 window 天，和 evaluate 一样，label 和 predict 要先对齐
+    所有指标长度都是 n - window，第 r 行是在第 r + window 天结束的窗口：
+    方向指标是第 r 天到第 r + window 天之间的变化，误差指标是第 r + 1 到第 r + window 天
+    """
+    label = np.asarray(label, dtype=float)
+    predict = np.asarray(predict, dtype=float)
+    tp, fp, fn, tn = (_rolling_sum(flag, window) for flag in confusion_flags(label, predict))
+    result = {"TP": tp, "FP": fp, "FN": fn, "TN": tn}
+    result.update(scores_from_counts(tp, fp, fn, tn))
+    # 误差窗口比方向窗口多一个（第0天就能算误差），去掉第一个，让同一行的结束日相同
+    error = label - predict
+    result["mse"] = _rolling_sum(error ** 2, window)[1:] / window
+    result["mae"] = _rolling_sum(np.abs(error), window)[1:] / window
+    return result
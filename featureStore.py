@@ -0,0 +1,141 @@
+"""
+Declarative rolling / lagged features for the LSTM inputs.
+
+Features are declared by name on top of the columns of a
+`sentimentDaily-*.csv` file (`sentiment`, `price`, and `count` = post volume
+when present):
+
+    <column>                raw column
+    <column>_lag_<k>        value k days earlier
+    <column>_diff_<k>       change over k days
+    <column>_ret_<k>        relative change over k days
+    <column>_logret_<k>     log return over k days
+    <column>_ma_<w>         rolling mean over w days
+    <column>_std_<w>        rolling standard deviation (volatility) over w days
+    <column>_z_<w>          (value - rolling mean) / rolling std over w days
+
+e.g. ['sentiment', 'price', 'price_ret_1', 'price_std_10', 'sentiment_ma_5', 'sentiment_lag_3', 'count'].
+
+All features are pandas/NumPy window operations over whole columns. Results
+are cached in `../dataset/.feature_cache`, keyed by the source file's content
+hash and the feature spec, so a wide set is only recomputed when either changes.
+
+For one new day at a time (LSTM_stream), `compute_last` evaluates the same
+features on the last `history_length` rows of the raw columns.
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = '../dataset/.feature_cache'
+_FEATURE = re.compile(r'^(?P<column>[A-Za-z]+)(?:_(?P<op>lag|diff|ret|logret|ma|std|z)_(?P<n>\d+))?$')
+
+
+def parse_feature(name):
+    match = _FEATURE.match(name)
+    if match is None:
+        raise ValueError("Invalid feature name: {}".format(name))
+    n = match.group('n')
+    return match.group('column'), match.group('op'), int(n) if n else None
+
+
+def compute_feature(series, op, n):
+    if op is None:
+        return series
+    if n < 1:
+        raise ValueError("Window / lag must be >= 1, got {}".format(n))
+    if op == 'lag':
+        return series.shift(n)
+    if op == 'diff':
+        return series.diff(n)
+    if op == 'ret':
+        return series.pct_change(n)
+    if op == 'logret':
+        return np.log(series).diff(n)
+    rolling = series.rolling(n, min_periods=n)
+    if op == 'ma':
+        return rolling.mean()
+    if op == 'std':
+        return rolling.std()
+    mean, std = rolling.mean(), rolling.std()
+    return (series - mean) / std.replace(0, np.nan)
+
+
+def raw_columns(feature_names):
+    """Raw columns the features are computed from, in order of first use."""
+    columns = []
+    for name in feature_names:
+        column = parse_feature(name)[0]
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+
+def history_length(feature_names):
+    """Rows of raw history needed to compute the features of the last row."""
+    length = 1
+    for name in feature_names:
+        _, op, n = parse_feature(name)
+        if op in ('lag', 'diff', 'ret', 'logret'):
+            length = max(length, n + 1)
+        elif op is not None:
+            length = max(length, n)
+    return length
+
+
+def compute_last(raw, feature_names):
+    """Features of the last row of `raw` (DataFrame of raw columns); NaN where the window is incomplete."""
+    values = []
+    for name in feature_names:
+        column, op, n = parse_feature(name)
+        values.append(compute_feature(raw[column].astype(np.float64), op, n).iloc[-1])
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), values, np.nan)
+
+
+def build_features(source, feature_names):
+    """Returns a DataFrame with one column per feature; rows without a full window are dropped."""
+    df = pd.read_csv(source)
+    columns = {}
+    for name in feature_names:
+        column, op, n = parse_feature(name)
+        if column not in df.columns:
+            raise KeyError("Feature {} needs column '{}', which is not in {}".format(name, column, source))
+        columns[name] = compute_feature(df[column].astype(np.float64), op, n)
+    features = pd.DataFrame(columns, index=df.index)
+    # 滚动窗口和滞后特征开头几行是NaN，去掉，保证所有特征对齐
+    return features.replace([np.inf, -np.inf], np.nan).dropna().reset_index(drop=True)
+
+
+def _cache_key(source, feature_names):
+    sha1 = hashlib.sha1()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    sha1.update(json.dumps(list(feature_names)).encode('utf-8'))
+    return sha1.hexdigest()[:16]
+
+
+def load_features(source, feature_names, cache_dir=CACHE_DIR):
+    """Cached `build_features`: (values [rows, features] float64, feature names)."""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    cache_file = os.path.join(cache_dir, '{}-{}.npy'.format(stem, _cache_key(source, feature_names)))
+    if os.path.exists(cache_file):
+        return np.load(cache_file), list(feature_names)
+    values = build_features(source, feature_names).to_numpy(dtype=np.float64)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 先写临时文件再原子替换，和 priceStore 的缓存一样，并发的进程不会读到写了一半的文件
+    fd, tmp_file = tempfile.mkstemp(suffix='.npy.tmp', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    return values, list(feature_names)
@@ -0,0 +1,298 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Lightweight instrumentation shared by the pipeline scripts.
+
+Stage timers, row counters / throughput, peak-memory samples and an optional
+sampling profiler. Everything is off unless enabled, either by calling
+`enable()` or by setting environment variables before the script starts:
+
+    PIPELINE_TRACE=trace.jsonl           write events as JSON lines
+    PIPELINE_TRACE=trace.json            write events in Chrome trace format (chrome://tracing, Perfetto)
+    PIPELINE_TRACE_FORMAT=jsonl|chrome   override the format picked from the file extension
+    PIPELINE_PROFILE_INTERVAL=0.005      also sample all thread stacks every N seconds,
+                                         written as collapsed stacks to <trace>.folded
+
+Each run starts a fresh trace file. Processes spawned by the run (e.g. the
+data-parallel training workers) inherit the environment; every process writes
+its events to its own `<trace>.part-<pid>` file and the process that started
+the run merges them into the trace when it flushes. Timestamps in all
+processes count from the start of the run, so their pid lanes line up.
+
+When disabled, `stage()` returns a shared no-op context manager and `traced`
+functions only pay one attribute check per call.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import Counter
+
+_RUN_ENV = 'PIPELINE_TRACE_RUN'  # 已经开始写的trace文件，由子进程继承
+_EPOCH_ENV = 'PIPELINE_TRACE_EPOCH'  # 这次运行开始的 time.time()，所有进程的时间戳都从这里算
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux 单位是KB，macOS 是字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_rows(self, n):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.rows = 0
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.tracer._stack().pop()
+        args = dict(self.args)
+        if self.rows:
+            args['rows'] = self.rows
+            args['rows_per_sec'] = self.rows / duration if duration > 0 else None
+        args['peak_rss_mb'] = _peak_rss_mb()
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+        self.tracer._emit({'name': self.name, 'ph': 'X', 'ts': self.tracer._ts(self.start),
+                           'dur': duration * 1e6, 'args': args})
+        return False
+
+    def add_rows(self, n):
+        self.rows += n
+
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of all threads and counts collapsed stacks."""
+
+    def __init__(self, interval):
+        super(_Sampler, self).__init__(name='instrument-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.format = 'jsonl'
+        self.events = []
+        self.sampler = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._root_pid = None  # 开始这次运行、负责合并分片的进程
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _ts(self, perf_time):
+        return (perf_time - self._origin) * 1e6  # microseconds, as in the Chrome trace format
+
+    def _emit(self, event):
+        event['pid'] = os.getpid()
+        event['tid'] = threading.get_ident()
+        with self._lock:
+            self.events.append(event)
+
+    def enable(self, path, fmt=None, sample_interval=None):
+        self.path = path
+        self.format = fmt or ('chrome' if path.endswith('.json') else 'jsonl')
+        self.enabled = True
+        # 新的一次运行清空trace文件和上次残留的分片，否则各次运行的事件会叠在一起
+        if os.environ.get(_RUN_ENV) != os.path.abspath(path):
+            for part in self._parts():
+                os.remove(part)
+            open(path, 'w').close()
+            os.environ[_RUN_ENV] = os.path.abspath(path)
+            os.environ[_EPOCH_ENV] = repr(time.time())
+            self._root_pid = os.getpid()
+        # 换算成同一个wall-clock起点，子进程的事件才能和父进程的对齐
+        epoch = float(os.environ.get(_EPOCH_ENV, time.time()))
+        self._origin = time.perf_counter() - (time.time() - epoch)
+        if sample_interval:
+            self.sampler = _Sampler(sample_interval)
+            self.sampler.start()
+
+    def _parts(self, kind='*'):
+        pattern = glob.escape(self.path)
+        if kind == '*':
+            return glob.glob(pattern + '.part-*') + glob.glob(pattern + '.folded.part-*')
+        return glob.glob(pattern + kind + '*')
+
+    def flush(self):
+        if not self.enabled or self.path is None:
+            return
+        with self._lock:
+            events, self.events = self.events, []
+        # 每个进程只追加自己的分片，多个进程不会同时改写同一个文件
+        with open('{}.part-{}'.format(self.path, os.getpid()), 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        if self.sampler is not None:
+            with open('{}.folded.part-{}'.format(self.path, os.getpid()), 'w', encoding='utf-8') as f:
+                for stack, hits in self.sampler.stacks.most_common():
+                    f.write('{} {}\n'.format(stack, hits))
+        if self._root_pid == os.getpid():
+            self._merge()
+
+    def _merge(self):
+        """Rewrites the trace (and `.folded`) from the part files of every process in the run."""
+        events = []
+        for part in self._parts('.part-'):
+            with open(part, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:  # 子进程还没写完的最后一行
+                        pass
+        events.sort(key=lambda event: event['ts'])
+        with open(self.path, 'w', encoding='utf-8') as f:
+            if self.format == 'chrome':
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            else:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+        stacks = Counter()
+        for part in self._parts('.folded.part-'):
+            with open(part, 'r', encoding='utf-8') as f:
+                for line in f:
+                    stack, _, hits = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        stacks[stack] += int(hits)
+        if stacks:
+            with open(self.path + '.folded', 'w', encoding='utf-8') as f:
+                for stack, hits in stacks.most_common():
+                    f.write('{} {}\n'.format(stack, hits))
+
+    def close(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.flush()
+        if self._root_pid == os.getpid():  # 已经合并进trace，删掉分片
+            for part in self._parts():
+                os.remove(part)
+        self.sampler = None
+        self.enabled = False
+
+
+tracer = Tracer()
+
+
+def enable(path, fmt=None, sample_interval=None):
+    tracer.enable(path, fmt, sample_interval)
+
+
+def stage(name, **args):
+    """Context manager timing a block; `as` target supports `add_rows(n)`."""
+    if not tracer.enabled:
+        return _NULL_STAGE
+    return _Stage(tracer, name, args)
+
+
+def traced(name=None):
+    """Decorator form of `stage`, named after the function by default."""
+
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Stage(tracer, stage_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_rows(n):
+    """Count rows processed by the innermost active stage of this thread."""
+    if not tracer.enabled:
+        return
+    stack = tracer._stack()
+    if stack:
+        stack[-1].add_rows(n)
+
+
+def count(name, value=1):
+    """Record a counter sample (shown as a counter track in Chrome trace)."""
+    if not tracer.enabled:
+        return
+    tracer._emit({'name': name, 'ph': 'C', 'ts': tracer._ts(time.perf_counter()), 'args': {name: value}})
+
+
+def gauge(name, value):
+    count(name, value)
+
+
+def memory_sample(name='peak_rss_mb'):
+    if not tracer.enabled:
+        return
+    count(name, _peak_rss_mb())
+
+
+if os.environ.get('PIPELINE_TRACE'):
+    _interval = os.environ.get('PIPELINE_PROFILE_INTERVAL')
+    enable(os.environ['PIPELINE_TRACE'], os.environ.get('PIPELINE_TRACE_FORMAT'),
+           float(_interval) if _interval else None)
+    atexit.register(tracer.close)
@@ -0,0 +1,46 @@
+"""
+Checkpoint loading without eager deserialization.
+
+`.safetensors` files are memory-mapped by `safetensors` (zero-copy); other
+files go through `torch.load(..., mmap=True)`, so tensor storage is paged in
+from the file on first use instead of being read and copied up front. Older
+torch versions and legacy (non-zip) checkpoints fall back to a plain load.
+
+`resolve_checkpoint` does not import torch, so the pipeline can find the model
+file a stage will load without paying for it.
+"""
+
+import os
+import re
+
+
+def resolve_checkpoint(checkpoint, output_dir):
+    """The given checkpoint, else the latest `checkpoint-<step>` in output_dir, else None."""
+    if checkpoint:
+        return checkpoint
+    if not os.path.isdir(output_dir):
+        return None
+    ckpts = [(int(filename.split('-')[1]), filename) for filename in os.listdir(output_dir) if
+             re.fullmatch(r'checkpoint-\d+', filename)]
+    return os.path.join(output_dir, max(ckpts)[1]) if ckpts else None
+
+
+def load_state(path, map_location='cpu'):
+    import torch
+    if path.endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(path, device=str(map_location))
+    try:
+        return torch.load(path, map_location=map_location, mmap=True)
+    except (TypeError, RuntimeError):  # torch < 2.1 没有 mmap 参数，或旧格式的checkpoint
+        return torch.load(path, map_location=map_location)
+
+
+def save_state(state_dict, path):
+    """Saves a flat dict of tensors; `.safetensors` paths use the zero-copy format."""
+    import torch
+    if path.endswith('.safetensors'):
+        from safetensors.torch import save_file
+        save_file({k: v.contiguous() for k, v in state_dict.items()}, path)
+    else:
+        torch.save(state_dict, path)
@@ -0,0 +1,338 @@
+"""
+Runs the whole pipeline as one DAG instead of five hand-edited `__main__` blocks.
+
+    preprocess.get_Top_user                                   -> top-userid.csv
+    preprocess.preprocess_file                  (per index)   -> sentiment.test.<index>
+    sentimentClassification.predict_file        (per index)   -> ClassificationResult-<index>-normal.csv
+    preprocess.split_expert_file                (per index)   -> ClassificationResult-<index>-expert.csv
+    dailyDataProcessing.process_group           (per index and user group) -> sentimentDaily-<index><group>.csv
+    LSTM_regression.main                        (optional, per index and user group)
+
+A stage is skipped when the content hashes of its inputs, its parameters and
+its outputs' existence are unchanged since the last successful run; the state
+is kept in `../dataset/.pipeline_state.json`. Per-index branches run
+concurrently in a thread pool of at most `--max_workers` threads.
+
+    python -m src.pipeline                              # incremental run of everything
+    python -m src.pipeline --index 恒生指数              # only one index's branch
+    python -m src.pipeline --stages split_expert,daily  # only some stage kinds
+    python -m src.pipeline --force                      # ignore the recorded state
+"""
+
+import os
+import json
+import fnmatch
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from src.modelIO import resolve_checkpoint
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATASET_DIR = '../dataset'
+STATE_FILE = os.path.join(DATASET_DIR, '.pipeline_state.json')
+STAGE_KINDS = ['top_users', 'preprocess', 'classify', 'split_expert', 'daily', 'lstm']
+DEFAULT_STAGE_KINDS = ['top_users', 'preprocess', 'classify', 'split_expert', 'daily']
+USER_GROUPS = ['normal', 'expert']
+
+
+def dataset_path(filename):
+    return os.path.join(DATASET_DIR, filename)
+
+
+class Stage(object):
+
+    def __init__(self, name, kind, func, inputs, outputs, params=None, deps=()):
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.deps = list(deps)
+
+
+class HashCache(object):
+    """Content hashes, reused while a file's size and mtime are unchanged."""
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+        self._lock = threading.Lock()
+
+    def digest(self, path):
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        with self._lock:
+            entry = self.entries.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['sha1']
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        with self._lock:
+            self.entries[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1.hexdigest()}
+        return sha1.hexdigest()
+
+
+class Runner(object):
+
+    def __init__(self, stages, force=False, max_workers=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.force = force
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        if os.path.exists(STATE_FILE):
+            with open(STATE_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        else:
+            state = {}
+        self.records = state.get('stages', {})
+        self.hashes = HashCache(state.get('hashes'))
+
+    def _signature(self, stage):
+        return {'inputs': {path: self.hashes.digest(path) for path in stage.inputs},
+                'params': json.dumps(stage.params, sort_keys=True, ensure_ascii=False)}
+
+    def _up_to_date(self, stage, signature):
+        if self.force or self.records.get(stage.name) != signature:
+            return False
+        return all(os.path.exists(path) for path in stage.outputs)
+
+    def _save_state(self):
+        with self.hashes._lock:
+            hashes = dict(self.hashes.entries)
+        with open(STATE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.records, 'hashes': hashes}, f, ensure_ascii=False, indent=1)
+
+    def run_stage(self, stage):
+        signature = self._signature(stage)
+        if self._up_to_date(stage, signature):
+            logger.info('skip %s (unchanged)', stage.name)
+            return False
+        missing = [path for path in stage.inputs if signature['inputs'][path] is None]
+        if missing:
+            raise FileNotFoundError('Stage {} is missing inputs: {}'.format(stage.name, missing))
+        logger.info('run  %s', stage.name)
+        stage.func(**stage.params)
+        with self._lock:
+            self.records[stage.name] = signature
+            self._save_state()
+        return True
+
+    def run(self, selected):
+        """Runs the selected stages in dependency order; stages outside the selection count as done."""
+        pending = [self.stages[name] for name in self._topological_order() if name in selected]
+        finished = {name for name in self.stages if name not in selected}
+        failed = []
+        running = {}
+        # 依赖都结束了才提交，线程不会占着等依赖，max_workers 就是同时运行的stage数上限
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for stage in [stage for stage in pending if all(dep in finished for dep in stage.deps)]:
+                    pending.remove(stage)
+                    if any(dep in failed for dep in stage.deps):
+                        logger.error('Stage %s failed: upstream stage failed', stage.name)
+                        failed.append(stage.name)
+                        finished.add(stage.name)
+                    else:
+                        running[executor.submit(self.run_stage, stage)] = stage
+                if not running:
+                    continue  # 刚标记失败的stage可能让下游变成就绪
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.error('Stage %s failed', stage.name, exc_info=error)
+                        failed.append(stage.name)
+                    finished.add(stage.name)
+        return failed
+
+    def _topological_order(self):
+        order, visited = [], set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+
+_classifier = {}
+_classifier_lock = threading.Lock()
+
+
+def classify(type, **classifier_args):
+    # 模型只加载一次，各个指数的分支共用
+    import torch
+    from src import sentimentClassification
+    with _classifier_lock:
+        if 'model' not in _classifier:
+            args = sentimentClassification.build_parser().parse_args([])
+            for key, value in classifier_args.items():
+                setattr(args, key, value)
+            model, tokenizer, _, max_seq_length, _ = sentimentClassification.load_model(args)
+            device = torch.device("cpu")
+            model.to(device)
+            _classifier.update(model=model, tokenizer=tokenizer, max_seq_length=max_seq_length,
+                               device=device, args=args)
+    sentimentClassification.predict_file(type, _classifier['model'], _classifier['tokenizer'],
+                                         _classifier['max_seq_length'], _classifier['device'], _classifier['args'])
+
+
+def top_users():
+    from src import preprocess
+    preprocess.get_Top_user()
+
+
+def preprocess_index(weibo_file):
+    from src import preprocess
+    preprocess.preprocess_file(weibo_file)
+
+
+def split_expert_index(type):
+    from src import preprocess
+    preprocess.split_expert_file(type)
+
+
+def daily_group(type, user_group):
+    from src import dailyDataProcessing
+    biggest_T, biggest_P = dailyDataProcessing.process_group(type, user_group)
+    logger.info('for type: %s%s ,the result is: T = %s, pearson = %s', type, user_group, biggest_T, biggest_P)
+
+
+def classifier_inputs(classifier_args):
+    """Model files the classify stage loads, found the same way as sentimentClassification.load_model."""
+    if classifier_args.get('model_type') == 'student':
+        return [classifier_args['student_checkpoint']]
+    model_file = resolve_checkpoint(classifier_args.get('checkpoint'), classifier_args.get('output_dir', DATASET_DIR))
+    if model_file:
+        return [model_file]
+    # 还没有微调过的checkpoint时用预训练的BERT
+    bert_model_dir = classifier_args['bert_model_dir']
+    if not os.path.isdir(bert_model_dir):
+        return []
+    return [os.path.join(bert_model_dir, name) for name in ('bert_config.json', 'pytorch_model.bin')]
+
+
+_lstm_lock = threading.Lock()
+
+
+def lstm_config(type, user_group):
+    from src import LSTM_regression
+    config = LSTM_regression.Config()
+    config.train_data_path = dataset_path('sentimentDaily-' + type + user_group + '.csv')
+    config.model_name = 'model_' + type + user_group + config.model_postfix[config.used_frame]
+    # log目录按秒命名，同一秒内跑完的分支会撞到同一个目录，每个分支用自己的子目录
+    config.log_save_path = os.path.join(config.log_save_path, type + user_group) + '/'
+    return config
+
+
+def lstm_outputs(type, user_group):
+    from src import LSTM_regression
+    config = lstm_config(type, user_group)
+    outputs = [config.model_save_path + config.model_name]
+    if config.save_stream_state:
+        outputs.append(LSTM_regression.get_stream_state_path(config))
+    return outputs
+
+
+def lstm_group(type, user_group):
+    from src import LSTM_regression
+    with _lstm_lock:  # load_logger 使用的是全局 root logger，LSTM 分支串行运行
+        LSTM_regression.main(lstm_config(type, user_group))
+
+
+def build_stages(indexes, classifier_args, kinds=STAGE_KINDS):
+    test_dir = DATASET_DIR
+    try:
+        from src import preprocess
+        test_dir = preprocess.config.get('path', 'DATA_SET', fallback=DATASET_DIR)
+    except ImportError:
+        pass
+
+    # get_Top_user 读取全部 *-weibo.csv，与 --index 的选择无关
+    weibo_files = sorted(dataset_path(eachFile) for eachFile in fnmatch.filter(os.listdir(DATASET_DIR), '*-weibo.csv'))
+    stages = [Stage('top_users', 'top_users', top_users, weibo_files, [dataset_path('top-userid.csv')])]
+    for type in indexes:
+        weibo_file = type + '-weibo.csv'
+        test_file = os.path.join(test_dir, 'sentiment.test.' + type)
+        normal_file = dataset_path('ClassificationResult-' + type + '-normal.csv')
+        expert_file = dataset_path('ClassificationResult-' + type + '-expert.csv')
+        stages.append(Stage('preprocess:' + type, 'preprocess', preprocess_index,
+                            [dataset_path(weibo_file)], [test_file], {'weibo_file': weibo_file}))
+        stages.append(Stage('classify:' + type, 'classify', classify,
+                            [test_file] + classifier_inputs(classifier_args),
+                            [normal_file], dict(classifier_args, type=type),
+                            deps=['preprocess:' + type]))
+        stages.append(Stage('split_expert:' + type, 'split_expert', split_expert_index,
+                            [normal_file, dataset_path('top-userid.csv')], [expert_file], {'type': type},
+                            deps=['classify:' + type, 'top_users']))
+        for user_group in USER_GROUPS:
+            result_file = dataset_path('ClassificationResult-' + type + '-' + user_group + '.csv')
+            daily_file = dataset_path('sentimentDaily-' + type + user_group + '.csv')
+            stages.append(Stage('daily:' + type + ':' + user_group, 'daily', daily_group,
+                                [result_file, dataset_path(type + '-price.csv')], [daily_file],
+                                {'type': type, 'user_group': user_group},
+                                deps=['split_expert:' + type]))
+            if 'lstm' in kinds:  # 只有要跑 lstm 时才导入 LSTM_regression（和torch）来找模型文件
+                stages.append(Stage('lstm:' + type + ':' + user_group, 'lstm', lstm_group,
+                                    [daily_file], lstm_outputs(type, user_group), {'type': type, 'user_group': user_group},
+                                    deps=['daily:' + type + ':' + user_group]))
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default=None, type=str,
+                        help="Comma separated index names (e.g. 恒生指数) to run; default is every *-weibo.csv.")
+    parser.add_argument("--stages", default=','.join(DEFAULT_STAGE_KINDS), type=str,
+                        help="Comma separated stage kinds to run, from: " + ','.join(STAGE_KINDS))
+    parser.add_argument("--force", default=False, action='store_true',
+                        help="Re-run the selected stages even if their inputs are unchanged.")
+    parser.add_argument("--max_workers", default=None, type=int,
+                        help="Maximum number of stages run at the same time (default: ThreadPoolExecutor's).")
+    parser.add_argument("--bert_model_dir", default='../models/chinese_L-12_H-768_A-12', type=str)
+    parser.add_argument("--checkpoint", default=None, type=str)
+    parser.add_argument("--predict_batch_size", default=8, type=int)
+    parser.add_argument("--model_type", default='bert', choices=['bert', 'student'])
+    parser.add_argument("--student_checkpoint", default='../models/student.pt', type=str)
+    parser.add_argument("--dedup", default=False, action='store_true',
+                        help="Only classify one post per near-duplicate cluster.")
+    args = parser.parse_args()
+
+    indexes = [eachFile.replace('-weibo.csv', '')
+               for eachFile in fnmatch.filter(os.listdir(DATASET_DIR), '*-weibo.csv')]
+    if args.index:
+        indexes = [type for type in indexes if type in args.index.split(',')]
+    kinds = args.stages.split(',')
+    unknown = set(kinds) - set(STAGE_KINDS)
+    if unknown:
+        raise ValueError("Unknown stage kinds: {}".format(sorted(unknown)))
+
+    classifier_args = {'bert_model_dir': args.bert_model_dir, 'checkpoint': args.checkpoint,
+                       'predict_batch_size': args.predict_batch_size, 'dedup': args.dedup,
+                       'model_type': args.model_type, 'student_checkpoint': args.student_checkpoint}
+    stages = build_stages(indexes, classifier_args, kinds)
+    selected = {stage.name for stage in stages if stage.kind in kinds}
+    failed = Runner(stages, force=args.force, max_workers=args.max_workers).run(selected)
+    if failed:
+        raise SystemExit('Failed stages: {}'.format(', '.join(failed)))
+
+
+if __name__ == "__main__":
+    main()
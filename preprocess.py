@@ -4,6 +4,7 @@ import os
 import pandas as pd
 import random
 import fnmatch
+from src.instrument import stage
 
 config = configparser.ConfigParser()
 config.read('../config.ini')
@@ -30,25 +31,28 @@ def split_expert():
     print(weibo_file_list)
     for eachFile in weibo_file_list:
         print("current file : " + eachFile)
-        type = eachFile.replace('-weibo.csv', '')
-        normalfile = '../dataset/ClassificationResult-' + type + '-normal' + '.csv'
-        expertfile = '../dataset/ClassificationResult-' + type + '-expert' + '.csv'
-        df_normal = pd.read_csv(normalfile, encoding='utf-8')
-        delet_list = df_normal[df_normal['user_id'].str.len() != 10].index.tolist()
-        df_normal.drop(index=delet_list, inplace=True)
-
-        # delete duplication
-        df_normal = df_normal.drop_duplicates(subset='Text', keep='last')
-        # transform user_id from sting to int
-        df_normal['user_id'] = df_normal['user_id'].apply(int)
-        df_user = pd.read_csv('../dataset/top-userid.csv', encoding='utf-8')
-        df_user['user_id'] = df_user['user_id'].apply(int)
-        ids = df_user['user_id'].values.tolist()
-        df_expert = df_normal[df_normal["user_id"].isin(ids)]
-        df_expert.to_csv(expertfile)
+        split_expert_file(eachFile.replace('-weibo.csv', ''))
     pass
 
 
+def split_expert_file(type):
+    normalfile = '../dataset/ClassificationResult-' + type + '-normal' + '.csv'
+    expertfile = '../dataset/ClassificationResult-' + type + '-expert' + '.csv'
+    df_normal = pd.read_csv(normalfile, encoding='utf-8')
+    delet_list = df_normal[df_normal['user_id'].str.len() != 10].index.tolist()
+    df_normal.drop(index=delet_list, inplace=True)
+
+    # delete duplication
+    df_normal = df_normal.drop_duplicates(subset='Text', keep='last')
+    # transform user_id from sting to int
+    df_normal['user_id'] = df_normal['user_id'].apply(int)
+    df_user = pd.read_csv('../dataset/top-userid.csv', encoding='utf-8')
+    df_user['user_id'] = df_user['user_id'].apply(int)
+    ids = df_user['user_id'].values.tolist()
+    df_expert = df_normal[df_normal["user_id"].isin(ids)]
+    df_expert.to_csv(expertfile)
+
+
 def preprocess():
     # file name style: 上证指数-normal-weibo.csv
     #                  上证指数-expert-weibo.csv
@@ -58,6 +62,17 @@ def preprocess():
     weibo_file_list = fnmatch.filter(os.listdir('../dataset'), patten)
     print(weibo_file_list)
     for eachFile in weibo_file_list:
+        preprocess_file(eachFile)
+
+
+    # with open(os.path.join(config['path']['DATA_SET'], 'sentiment.train'), 'w',encoding = 'utf-8') as st:
+    #    for index,item in df_train.iterrows():
+    #        text = item['review'] + '\t' + str(item['label']) +'\n'
+    #        st.write(text)
+
+
+def preprocess_file(eachFile):
+    with stage('preprocess', file=eachFile) as st:
         df_test = pd.read_csv('../dataset/' + eachFile, encoding='utf-8')
         testfile = 'sentiment.test' + '.' + eachFile.replace('-weibo.csv', '')
         print('name of test file is  ' + testfile)
@@ -66,12 +81,7 @@ def preprocess():
                 text = str(item['text']) + '\t' + str(item['user_id']) + '\t' + str(item['time']) + '\n'
                 #  + str(item['']) + '\t' + str(item['']) + '\t' + str(item['']) + '\n'
                 sd.write(text)
-
-
-    # with open(os.path.join(config['path']['DATA_SET'], 'sentiment.train'), 'w',encoding = 'utf-8') as st:
-    #    for index,item in df_train.iterrows():
-    #        text = item['review'] + '\t' + str(item['label']) +'\n'
-    #        st.write(text)
+        st.add_rows(df_test.shape[0])
 
 
 if __name__ == "__main__":
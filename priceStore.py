@@ -0,0 +1,111 @@
+import os
+import zipfile
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ["Open", "Close", "High", "Low"]
+CACHE_DIR = '../dataset/.price_cache'
+_loaded = {}
+
+
+def _file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def parse_price_csv(path):
+    """Parses a `<type>-price.csv` file into sorted datetime64[D] dates and float64 price columns."""
+    # thousands=',' 处理恒生指数价格中的千分位
+    df = pd.read_csv(path, encoding='utf-8', thousands=',')
+    dates = pd.to_datetime(df["Date"], format='%Y年%m月%d日', errors='coerce')
+    if dates.isna().any():  # 兼容其他日期写法
+        dates = dates.fillna(pd.to_datetime(df["Date"], errors='coerce'))
+    df = df.assign(Date=dates).dropna(subset=["Date"])
+    df = df.sort_values("Date").drop_duplicates(subset="Date", keep='last')
+    columns = {}
+    for name in PRICE_COLUMNS:
+        if name in df.columns:
+            columns[name] = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64)
+    return df["Date"].to_numpy(dtype='datetime64[D]'), columns
+
+
+class PriceStore(object):
+    """Date-indexed price history of one index, backed by a binary cache of the parsed csv."""
+
+    def __init__(self, dates, columns):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.columns = columns
+        self.validate()
+
+    def validate(self):
+        if self.dates.size == 0:
+            raise ValueError("Price history is empty")
+        if np.any(np.diff(self.dates.astype(np.int64)) <= 0):
+            raise ValueError("Price dates must be strictly increasing")
+        for name, values in self.columns.items():
+            if values.shape != self.dates.shape:
+                raise ValueError("Column {} has {} rows, expected {}".format(name, values.shape[0], self.dates.shape[0]))
+        if "Open" in self.columns and not np.all(np.isfinite(self.columns["Open"])):
+            raise ValueError("Open price contains missing or non-numeric values")
+
+    @classmethod
+    def load(cls, type, dataset_dir='../dataset', cache_dir=CACHE_DIR):
+        """Loads `<type>-price.csv`, converting it once into `<cache_dir>/<type>-price.npz`."""
+        source = os.path.join(dataset_dir, type + '-price.csv')
+        stat = os.stat(source)
+        key = (source, stat.st_size, stat.st_mtime)
+        if key in _loaded:
+            return _loaded[key]
+
+        cache_file = os.path.join(cache_dir, type + '-price.npz')
+        store = None
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file, allow_pickle=False) as cached:
+                    same_stat = cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime
+                    if same_stat or str(cached['sha1']) == _file_sha1(source):
+                        store = cls(cached['dates'], {name: cached['col_' + name] for name in PRICE_COLUMNS
+                                                      if 'col_' + name in cached.files})
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):  # 损坏的缓存当作没有缓存，重新生成
+                store = None
+        if store is None:
+            dates, columns = parse_price_csv(source)
+            store = cls(dates, columns)
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再原子替换，并发的 daily 分支同时生成同一个缓存时不会读到写了一半的文件
+            fd, tmp_file = tempfile.mkstemp(suffix='.npz.tmp', dir=cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, dates=store.dates, size=stat.st_size, mtime=stat.st_mtime, sha1=_file_sha1(source),
+                             **{'col_' + name: values for name, values in columns.items()})
+                os.replace(tmp_file, cache_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+        _loaded[key] = store
+        return store
+
+    def _positions(self, dates):
+        return np.searchsorted(self.dates, np.asarray(dates, dtype='datetime64[D]'), side='right') - 1
+
+    def asof(self, dates, column="Open"):
+        """Price of the last trading day on or before each date; NaN before the first day."""
+        positions = self._positions(dates)
+        values = self.columns[column][np.maximum(positions, 0)]
+        return np.where(positions >= 0, values, np.nan)
+
+    def range(self, start, end, column="Open"):
+        """Trading days and prices within [start, end]."""
+        lo = np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')
+        return self.dates[lo:hi], self.columns[column][lo:hi]
+
+    def to_frame(self, columns=("Open",)):
+        data = {"Date": self.dates.astype('datetime64[ns]')}
+        data.update({name: self.columns[name] for name in columns})
+        return pd.DataFrame(data)
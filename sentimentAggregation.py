@@ -0,0 +1,64 @@
+import logging
+import numpy as np
+import pandas as pd
+
+RESOLUTIONS = ['5min', '1h', '1D']
+logger = logging.getLogger(__name__)
+
+
+def parse_times(raw):
+    # pandas 2 默认按第一行推断一个格式，其他格式的时间全变成NaT；'mixed' 逐个解析。pandas 1 本来就逐个解析
+    if int(pd.__version__.split('.')[0]) >= 2:
+        return pd.to_datetime(raw, errors='coerce', format='mixed')
+    return pd.to_datetime(raw, errors='coerce')
+
+
+def load_classification_result(type, user_group):
+    """Reads `ClassificationResult-<type>-<user_group>.csv` with the post time as a datetime column."""
+    currentFile = '../dataset/ClassificationResult-' + type + '-' + user_group + '.csv'
+    df = pd.read_csv(currentFile, usecols=lambda c: c in ('Date', 'Time', 'Expected'))
+    # 旧的结果文件只有日期，没有 Time 列；Time 解析不了的行也退回用日期
+    times = parse_times(df['Time']) if 'Time' in df.columns else pd.Series(pd.NaT, index=df.index)
+    if 'Date' in df.columns:
+        times = times.fillna(parse_times(df['Date']))
+    df['Time'] = times
+    df['Expected'] = pd.to_numeric(df['Expected'], errors='coerce')
+    result = df.dropna(subset=['Time', 'Expected'])[['Time', 'Expected']].reset_index(drop=True)
+    if len(result) < len(df):
+        logger.warning("Dropped %d of %d rows of %s with an invalid time or label",
+                       len(df) - len(result), len(df), currentFile)
+    return result
+
+
+def aggregate(times, values, resolutions=RESOLUTIONS):
+    """
+    Mean sentiment and post count per time bucket, for several resolutions.
+
+    Sorts once; each resolution is then a floor of the sorted int64 timestamps
+    and a segmented sum with `np.add.reduceat`, so no per-resolution groupby.
+    Returns {resolution: DataFrame[Date, Expected, count]}.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]').astype(np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(times, kind='stable')
+    times, values = times[order], values[order]
+
+    result = {}
+    for resolution in resolutions:
+        step = pd.Timedelta(resolution).value
+        buckets = times - times % step  # 排序后的向下取整仍然有序
+        if buckets.size == 0:
+            starts = np.array([], dtype=np.int64)
+        else:
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+        sums = np.add.reduceat(values, starts) if starts.size else np.array([])
+        counts = np.diff(np.append(starts, buckets.size))
+        result[resolution] = pd.DataFrame({'Date': pd.to_datetime(buckets[starts]),
+                                           'Expected': sums / np.maximum(counts, 1),
+                                           'count': counts})
+    return result
+
+
+def aggregate_file(type, user_group, resolutions=RESOLUTIONS):
+    df = load_classification_result(type, user_group)
+    return aggregate(df['Time'].values, df['Expected'].values, resolutions)
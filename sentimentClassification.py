@@ -1,22 +1,28 @@
 import os
-import re
-import codecs
+import json
+import time
+import datetime
 import logging
+import contextlib
 import argparse
 import configparser
 import random
 from tqdm import tqdm, trange
 import numpy as np
-from sklearn.metrics import precision_recall_fscore_support
 import torch
-from tensorboardX import SummaryWriter
 from torch.utils.data import TensorDataset, DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+# pytorch_pretrained_bert 的 __init__ 会导入所有模型、optimization 和 file_utils（以及tqdm），
+# 预测也需要 BertTokenizer / BertModel，所以这些不延迟导入，延迟也省不了时间
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 from pytorch_pretrained_bert.modeling import BertPreTrainedModel, BertModel
 from pytorch_pretrained_bert.optimization import BertAdam
 from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE
-import pandas as pd
 import fnmatch
+from src.instrument import traced, add_rows
+from src import dedup
+from src.modelIO import load_state, resolve_checkpoint
 
 config = configparser.ConfigParser()
 config.read('../config.ini')
@@ -38,13 +44,15 @@ class BertForSmooth(BertPreTrainedModel):
         self.loss = torch.nn.CrossEntropyLoss()
         self.apply(self.init_bert_weights)
 
-    def forward(self, input_ids, segment_ids, input_mask, labels=None):
+    def forward(self, input_ids, segment_ids, input_mask, labels=None, return_pooled=False):
         _, pooled_output = self.bert(input_ids, segment_ids, input_mask, output_all_encoded_layers=False)
         if labels is not None:
             pooled_output = self.dropout(pooled_output)
         logits = self.classifier(pooled_output)
         if labels is not None:
             return self.loss(logits, labels)
+        elif return_pooled:  # 同时返回768维的pooled向量，用于embeddingStore
+            return logits, pooled_output
         else:
             return logits
 
@@ -88,7 +96,7 @@ class DataProcessor(object):
     @staticmethod
     def get_test_examples(eachFileName):
         """Gets a collection of `InputExample`s for prediction."""
-        ids, examples, publish_date, user_id = [], [], [], []
+        ids, examples, publish_date, user_id, publish_times = [], [], [], [], []
         i = 0
         currentFilename = '../dataset/sentiment.test.' + eachFileName
         for line in open(currentFilename, 'r', encoding='utf-8'):
@@ -99,14 +107,17 @@ class DataProcessor(object):
                 examples.append(InputExample("".join(tokens[0])))
                 publish_time = tokens[-1]
                 publish_date.append(publish_time.split(' ')[0])
+                publish_times.append(publish_time)
                 ids.append(i)
                 user_id.append(tokens[1])
                 i = i + 1
-        return ids, examples, publish_date, user_id
+        return ids, examples, publish_date, user_id, publish_times
 
 
+@traced()
 def convert_examples_to_features(examples, max_seq_length, tokenizer, has_label=True):
     """Loads a data file into a list of `InputBatch`s."""
+    add_rows(len(examples))
 
     features = []
     for index, example in enumerate(examples):
@@ -159,15 +170,21 @@ def features_to_tensor(ds_features, need_labels=True):
     return ds_data
 
 
-def do_predict(dataloader, model, device):
+@traced()
+def do_predict(dataloader, model, device, embedding_writer=None):
     model.eval()
+    add_rows(len(dataloader.dataset))
     class_probas = []
     predictions = []
     for batch in tqdm(dataloader, desc="Iteration"):
         logger.info(" iterating------------")
         batch = tuple(t.to(device) for t in batch)
         input_ids, input_mask, segment_ids = batch
-        logits = model(input_ids, segment_ids, input_mask)
+        if embedding_writer is not None:
+            logits, pooled_output = model(input_ids, segment_ids, input_mask, return_pooled=True)
+            embedding_writer.append(pooled_output.detach().cpu().numpy())
+        else:
+            logits = model(input_ids, segment_ids, input_mask)
 
         class_proba = torch.nn.functional.softmax(logits, 1)
         class_proba = class_proba.detach().cpu().numpy()
@@ -177,7 +194,7 @@ def do_predict(dataloader, model, device):
     return predictions, class_probas
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser()
     # Required parameters
     parser.add_argument("--data_dir",
@@ -250,24 +267,63 @@ def main():
                         type=int,
                         default=1,
                         help="Number of updates steps to accumulate before performing a backward/update pass.")
-
-    args = parser.parse_args()
-
-    device = torch.device("cpu")
-    use_gpu = False
-    logger.info("device: {}".format(device))
-
+    parser.add_argument("--world_size",
+                        default=1,
+                        type=int,
+                        help="Number of local data-parallel CPU training processes (torch.distributed, gloo).")
+    parser.add_argument("--dist_port",
+                        default=29500,
+                        type=int,
+                        help="Local TCP port used to set up the training process group.")
+    parser.add_argument("--dist_timeout",
+                        default=360,
+                        type=int,
+                        help="Minutes the training processes wait for each other, e.g. while rank 0 runs the dev "
+                             "evaluation.")
+    parser.add_argument("--benchmark_steps",
+                        default=0,
+                        type=int,
+                        help="Stop training after this many optimizer steps (0 = train normally).")
+    parser.add_argument("--throughput_file",
+                        default=None,
+                        type=str,
+                        help="Write the measured training throughput to this JSON file.")
+    parser.add_argument("--model_type",
+                        default='bert',
+                        choices=['bert', 'student'],
+                        help="Predict with the full BERT teacher or a distilled student (see distillation.py).")
+    parser.add_argument("--student_checkpoint",
+                        default='../models/student.pt',
+                        type=str,
+                        help="Student checkpoint used when --model_type student.")
+    parser.add_argument("--embedding_dir",
+                        default=None,
+                        type=str,
+                        help="Also store the pooled BERT output of every classified post in <embedding_dir>/<index>.")
+    parser.add_argument("--embedding_float32",
+                        default=False,
+                        action='store_true',
+                        help="Store embeddings as float32 instead of float16.")
+    parser.add_argument("--dedup",
+                        default=False,
+                        action='store_true',
+                        help="Collapse reposts and near-duplicate posts and only classify one post per cluster.")
+    return parser
+
+
+def load_model(args):
+    """Loads the latest (or the given) checkpoint, falling back to the pre-trained BERT weights."""
+    if getattr(args, 'model_type', 'bert') == 'student':
+        from src.distillation import load_student
+        logging.info('Load student %s' % args.student_checkpoint)
+        model, max_seq_length, lower_case = load_student(args.student_checkpoint)
+        tokenizer = BertTokenizer.from_pretrained(args.bert_model_dir, do_lower_case=lower_case)
+        return model, tokenizer, 0, max_seq_length, lower_case
     os.makedirs(args.output_dir, exist_ok=True)
-    ckpts = [(int(filename.split('-')[1]), filename) for filename in os.listdir(args.output_dir) if
-             re.fullmatch('checkpoint-\d+', filename)]
-    ckpts = sorted(ckpts, key=lambda x: x[0])
-    if args.checkpoint or ckpts:
-        if args.checkpoint:
-            model_file = args.checkpoint
-        else:
-            model_file = os.path.join(args.output_dir, ckpts[-1][1])
+    model_file = resolve_checkpoint(args.checkpoint, args.output_dir)
+    if model_file:
         logging.info('Load %s' % model_file)
-        checkpoint = torch.load(model_file, map_location='cpu')
+        checkpoint = load_state(model_file)
         global_step = checkpoint['step']
         max_seq_length = checkpoint['max_seq_length']
         lower_case = checkpoint['lower_case']
@@ -279,91 +335,176 @@ def main():
         model = BertForSmooth.from_pretrained(args.bert_model_dir, cache_dir=PYTORCH_PRETRAINED_BERT_CACHE)
     # 分词器
     tokenizer = BertTokenizer.from_pretrained(args.bert_model_dir, do_lower_case=lower_case)
-    model.to(device)
-
-    # train
-    if args.do_train:
-
-        if args.gradient_accumulation_steps < 1:
-            raise ValueError("Invalid gradient_accumulation_steps parameter: {}, should be >= 1".format(
-                args.gradient_accumulation_steps))
-
-        args.train_batch_size = int(args.train_batch_size / args.gradient_accumulation_steps)
-
-        random.seed(args.seed)
-        np.random.seed(args.seed)
-        torch.manual_seed(args.seed)
-        if use_gpu:
-            torch.cuda.manual_seed_all(args.seed)
-
-        train_examples = DataProcessor.get_train_examples(args.data_dir)
-        num_train_steps = int(
-            len(train_examples) / args.train_batch_size / args.gradient_accumulation_steps * args.num_train_epochs)
-
-        # Prepare optimizer
-        param_optimizer = list(model.named_parameters())
-        no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
-        optimizer_grouped_parameters = [
-            {'params': [p for n, p in param_optimizer if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
-            {'params': [p for n, p in param_optimizer if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-        ]
-        optimizer = BertAdam(optimizer_grouped_parameters, lr=args.learning_rate, warmup=args.warmup_proportion,
-                             t_total=num_train_steps)
-
-        train_features = convert_examples_to_features(train_examples, max_seq_length, tokenizer)
-        train_data = features_to_tensor(train_features)
+    return model, tokenizer, global_step, max_seq_length, lower_case
+
+
+def predict_file(type, model, tokenizer, max_seq_length, device, args):
+    """Classifies `sentiment.test.<type>` and writes `ClassificationResult-<type>-normal.csv`."""
+    ids, predict_examples, publish_date, user_id, publish_times = DataProcessor.get_test_examples(type)
+    classify_examples = predict_examples
+    if args.dedup:
+        representative_of, representatives = dedup.cluster([example.sentence for example in predict_examples])
+        dedup.report(len(predict_examples), representatives)
+        classify_examples = [predict_examples[i] for i in representatives]
+    predict_features = convert_examples_to_features(classify_examples, max_seq_length, tokenizer, False)
+    predict_data = features_to_tensor(predict_features)
+    predict_sampler = SequentialSampler(predict_data)
+    predict_dataloader = DataLoader(predict_data, sampler=predict_sampler, batch_size=args.predict_batch_size)
+    embedding_writer = None
+    if getattr(args, 'embedding_dir', None):
+        if args.model_type != 'bert':
+            raise ValueError("--embedding_dir stores BERT pooled outputs and needs --model_type bert")
+        from src.embeddingStore import EmbeddingWriter
+        embedding_writer = EmbeddingWriter(os.path.join(args.embedding_dir, type), float16=not args.embedding_float32)
+    logger.info(" predict start ------------")
+    predictions, class_probas = do_predict(predict_dataloader, model, device, embedding_writer)
+    logger.info(" predict finished ------------")
+    if embedding_writer is not None:
+        if args.dedup:  # 只存每个簇的代表，其余微博通过alias指向代表所在的行
+            rows = np.searchsorted(representatives, representative_of)
+            embedding_writer.close([ids[i] for i in representatives],
+                                   aliases=np.stack([np.asarray(ids), rows], axis=1))
+        else:
+            embedding_writer.close(ids)
+    if args.dedup:  # 每个簇代表的结果复制给簇内所有微博
+        predictions = dedup.fan_out(predictions, representative_of, representatives)
+        class_probas = dedup.fan_out(class_probas, representative_of, representatives)
+    # print("len of prediction: " + str(len(predictions)) + "len of class probability: " + str(len(
+    # class_probas)))
+
+    eachFileResult = 'ClassificationResult-' + type + '-normal.csv'
+    writer = open(os.path.join(args.output_dir, eachFileResult), 'w', encoding='utf-8')
+    writer.write('ID,user_id,Text,Date,Expected,Time\n')
+    for _id, label in zip(ids, predictions):
+        # print("id :"+ str(_id) + "prediction: " +str(predictions[_id]))
+        writer.write(str(_id) + ',' + str(user_id[_id]) + ',' + str(predict_examples[_id].sentence.replace(',', '，'))
+                     + ',' + str(publish_date[_id]) + ',' + str(label) + ',' + publish_times[_id].replace(',', ' ')
+                     + '\n')
+    writer.close()
+
+
+def save_checkpoint(args, model, global_step, max_seq_length, lower_case, top_ckpts):
+    """Writes checkpoint-<global_step> and keeps only the latest 5."""
+    model_to_save = model.module if hasattr(model, 'module') else model  # Only save the model it-self
+    torch.save({'step': global_step, 'model_state': model_to_save.state_dict(),
+                'max_seq_length': max_seq_length, 'lower_case': lower_case},
+               os.path.join(args.output_dir, 'checkpoint-%d' % global_step))
+
+    top_ckpts.append(global_step)
+    if len(top_ckpts) > 5:
+        os.system('rm %s' % os.path.join(args.output_dir, 'checkpoint-%d' % top_ckpts[0]))
+        top_ckpts.pop(0)
+
+
+def train(args, model, tokenizer, global_step, max_seq_length, lower_case, device, rank=0, world_size=1):
+    """Fine-tunes `model`; with world_size > 1 this runs inside one torch.distributed worker."""
+    # 只有训练才需要的依赖，预测时不导入
+    from sklearn.metrics import precision_recall_fscore_support
+    from tensorboardX import SummaryWriter
+
+    if args.gradient_accumulation_steps < 1:
+        raise ValueError("Invalid gradient_accumulation_steps parameter: {}, should be >= 1".format(
+            args.gradient_accumulation_steps))
+
+    args.train_batch_size = int(args.train_batch_size / args.gradient_accumulation_steps)
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    train_examples = DataProcessor.get_train_examples(args.data_dir)
+    # 多进程时每个进程只训练 1/world_size 的数据
+    num_train_steps = int(len(train_examples) / world_size / args.train_batch_size /
+                          args.gradient_accumulation_steps * args.num_train_epochs)
+
+    # Prepare optimizer
+    param_optimizer = list(model.named_parameters())
+    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+    optimizer_grouped_parameters = [
+        {'params': [p for n, p in param_optimizer if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
+        {'params': [p for n, p in param_optimizer if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+    ]
+    optimizer = BertAdam(optimizer_grouped_parameters, lr=args.learning_rate, warmup=args.warmup_proportion,
+                         t_total=num_train_steps)
+
+    train_features = convert_examples_to_features(train_examples, max_seq_length, tokenizer)
+    train_data = features_to_tensor(train_features)
+    if world_size > 1:
+        train_sampler = DistributedSampler(train_data, num_replicas=world_size, rank=rank, shuffle=True,
+                                           seed=args.seed)
+    else:
         train_sampler = RandomSampler(train_data)
-        train_dataloader = DataLoader(train_data, sampler=train_sampler, batch_size=args.train_batch_size)
-
-        dev_examples = DataProcessor.get_dev_examples(args.data_dir)
-        dev_features = convert_examples_to_features(dev_examples, max_seq_length, tokenizer)
-        dev_data = features_to_tensor(dev_features, False)
-        dev_labels = [example.label for example in dev_examples]
-        dev_sampler = SequentialSampler(dev_data)
-        dev_dataloader = DataLoader(dev_data, sampler=dev_sampler, batch_size=args.predict_batch_size)
-
-        logger.info("***** Running training *****")
-        logger.info("  Num examples = %d", len(train_examples))
-        logger.info("  Batch size = %d", args.train_batch_size)
-        logger.info("  Num steps = %d", num_train_steps)
-
-        sw = SummaryWriter()  # tensorboard显示数据收集
-        top_ckpts = []
-        threshold = 0
-        start_epoch = int(
-            global_step / (len(train_examples) / args.train_batch_size / args.gradient_accumulation_steps))
-        residue_step = global_step % (len(
-            train_examples) / args.train_batch_size / args.gradient_accumulation_steps) * args.gradient_accumulation_steps
-        model.train()
-        for epoch in trange(start_epoch, args.num_train_epochs, desc="Epoch"):
-            for step, batch in enumerate(tqdm(train_dataloader, desc="Iteration")):
-                if epoch == start_epoch and step <= residue_step:
-                    continue
-                batch = tuple(t.to(device) for t in batch)
-                input_ids, input_mask, segment_ids, labels = batch
-
+    train_dataloader = DataLoader(train_data, sampler=train_sampler, batch_size=args.train_batch_size)
+
+    dev_examples = DataProcessor.get_dev_examples(args.data_dir)
+    dev_features = convert_examples_to_features(dev_examples, max_seq_length, tokenizer)
+    dev_data = features_to_tensor(dev_features, False)
+    dev_labels = [example.label for example in dev_examples]
+    dev_sampler = SequentialSampler(dev_data)
+    dev_dataloader = DataLoader(dev_data, sampler=dev_sampler, batch_size=args.predict_batch_size)
+
+    logger.info("***** Running training *****")
+    logger.info("  Num examples = %d", len(train_examples))
+    logger.info("  Batch size = %d", args.train_batch_size)
+    logger.info("  Num steps = %d", num_train_steps)
+    logger.info("  Num workers = %d", world_size)
+
+    if world_size > 1:
+        model = DistributedDataParallel(model)
+    is_main = rank == 0  # 只有0号进程写tensorboard、做dev评估和保存checkpoint
+    sw = SummaryWriter() if is_main else None  # tensorboard显示数据收集
+    top_ckpts = []
+    threshold = 0
+    # global_step 是每个进程的步数，多进程时每步训练 world_size 倍的数据，评估/保存的间隔按数据量折算
+    eval_start_step = 20000 // world_size
+    eval_interval = max(1, 2000 // world_size)
+    start_epoch = int(
+        global_step / (len(train_examples) / world_size / args.train_batch_size / args.gradient_accumulation_steps))
+    residue_step = global_step % (len(train_examples) / world_size / args.train_batch_size /
+                                  args.gradient_accumulation_steps) * args.gradient_accumulation_steps
+    model.train()
+    start_time = time.perf_counter()
+    trained_examples = 0
+    finished = False
+    for epoch in trange(start_epoch, args.num_train_epochs, desc="Epoch", disable=not is_main):
+        if world_size > 1:
+            train_sampler.set_epoch(epoch)
+        for step, batch in enumerate(tqdm(train_dataloader, desc="Iteration", disable=not is_main)):
+            if epoch == start_epoch and step <= residue_step:
+                continue
+            batch = tuple(t.to(device) for t in batch)
+            input_ids, input_mask, segment_ids, labels = batch
+
+            update_step = (step + 1) % args.gradient_accumulation_steps == 0
+            # 梯度累积的中间步不做all-reduce
+            sync_context = model.no_sync() if world_size > 1 and not update_step else contextlib.nullcontext()
+            with sync_context:
                 loss = model(input_ids, segment_ids, input_mask, labels)
 
                 if args.gradient_accumulation_steps > 1:
                     loss = loss / args.gradient_accumulation_steps
 
-                sw.add_scalar('loss', loss.clone().cpu().data.numpy().mean(), global_step)
+                if is_main:
+                    sw.add_scalar('loss', loss.clone().cpu().data.numpy().mean(), global_step)
 
                 # 并行划分数据到gpu的情况下, 每块gpu都会返回一个loss
                 loss = loss.mean()
                 loss.backward()
-
-                if (step + 1) % args.gradient_accumulation_steps == 0:
-                    # modify learning rate with special warm up BERT uses
-                    lr_this_step = args.learning_rate * warmup_linear(global_step / num_train_steps,
-                                                                      args.warmup_proportion)
-                    for param_group in optimizer.param_groups:
-                        param_group['lr'] = lr_this_step
-                    optimizer.step()
-                    optimizer.zero_grad()
-                    global_step += 1
-                if global_step > 20000 and (step + 1) % 2000 == 0:
-                    dev_predictions, _ = do_predict(dev_dataloader, model, device)
+            trained_examples += input_ids.shape[0]
+
+            if update_step:
+                # modify learning rate with special warm up BERT uses
+                lr_this_step = args.learning_rate * warmup_linear(global_step / num_train_steps,
+                                                                  args.warmup_proportion)
+                for param_group in optimizer.param_groups:
+                    param_group['lr'] = lr_this_step
+                optimizer.step()
+                optimizer.zero_grad()
+                global_step += 1
+            # 各进程的 global_step 和 step 相同，所以所有进程同时进入这里
+            if global_step > eval_start_step and (step + 1) % eval_interval == 0:
+                if is_main:
+                    dev_predictions, _ = do_predict(dev_dataloader, model.module if world_size > 1 else model, device)
                     model.train()
                     precision, recall, f1, _ = precision_recall_fscore_support(dev_labels, dev_predictions,
                                                                                average='macro')
@@ -371,15 +512,67 @@ def main():
                     sw.add_scalar('precision', precision, global_step)
                     sw.add_scalar('recall', recall, global_step)
                     sw.add_scalar('f1', f1, global_step)
-                    model_to_save = model.module if hasattr(model, 'module') else model  # Only save the model it-self
-                    torch.save({'step': global_step, 'model_state': model_to_save.state_dict(),
-                                'max_seq_length': max_seq_length, 'lower_case': lower_case},
-                               os.path.join(args.output_dir, 'checkpoint-%d' % global_step))
+                    save_checkpoint(args, model, global_step, max_seq_length, lower_case, top_ckpts)
+                if world_size > 1:
+                    # 其他进程在这里等0号进程评估完，而不是卡在下一次all-reduce里
+                    torch.distributed.barrier()
+            if args.benchmark_steps and global_step >= args.benchmark_steps:
+                finished = True
+                break
+        if finished:
+            break
+
+    # 吞吐量：各进程处理的样本数相同（DistributedSampler会补齐）
+    elapsed = time.perf_counter() - start_time
+    examples_per_sec = trained_examples * world_size / elapsed if elapsed > 0 else float('inf')
+    if is_main:
+        # 训练结束总是保存一次，否则多进程训练后主进程 load_model 拿不到训练好的参数
+        # 只测吞吐量(--benchmark_steps)时不保存，免得之后 load_model 加载到只训练了几步的模型
+        if not args.benchmark_steps and (not top_ckpts or top_ckpts[-1] != global_step):
+            save_checkpoint(args, model, global_step, max_seq_length, lower_case, top_ckpts)
+        sw.close()
+        logger.info("Training throughput with %d worker(s): %.2f examples/s", world_size, examples_per_sec)
+        if args.throughput_file:
+            with open(args.throughput_file, 'w', encoding='utf-8') as f:
+                json.dump({'world_size': world_size, 'examples_per_sec': examples_per_sec,
+                           'examples': trained_examples * world_size, 'seconds': elapsed}, f)
+
+
+def train_worker(rank, args):
+    """One data-parallel CPU training process (gloo backend)."""
+    world_size = args.world_size
+    torch.distributed.init_process_group('gloo', init_method='tcp://127.0.0.1:%d' % args.dist_port,
+                                         rank=rank, world_size=world_size,
+                                         timeout=datetime.timedelta(minutes=args.dist_timeout))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))  # 每个进程分到的CPU核数
+    if rank != 0:
+        logger.setLevel(logging.WARNING)
+    try:
+        model, tokenizer, global_step, max_seq_length, lower_case = load_model(args)
+        train(args, model, tokenizer, global_step, max_seq_length, lower_case, torch.device("cpu"), rank, world_size)
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+def main():
+    args = build_parser().parse_args()
+
+    device = torch.device("cpu")
+    logger.info("device: {}".format(device))
+
+    # train
+    if args.do_train:
+        if args.model_type != 'bert':
+            raise ValueError("--do_train only supports --model_type bert, use distillation.py to train a student")
+        if args.world_size > 1:
+            # 训练在子进程中进行，结束后主进程加载最新的checkpoint做预测
+            torch.multiprocessing.spawn(train_worker, args=(args,), nprocs=args.world_size)
+
+    model, tokenizer, global_step, max_seq_length, lower_case = load_model(args)
+    model.to(device)
 
-                    top_ckpts.append(global_step)
-                    if len(top_ckpts) > 5:
-                        os.system('rm %s' % os.path.join(args.output_dir, 'checkpoint-%d' % top_ckpts[0]))
-                        top_ckpts.pop(0)
+    if args.do_train and args.world_size == 1:
+        train(args, model, tokenizer, global_step, max_seq_length, lower_case, device)
 
     if args.do_predict:
         logger.info(" doing predict ------------")
@@ -387,25 +580,7 @@ def main():
         weibo_file_list = fnmatch.filter(os.listdir('../dataset'), patten)
         for eachFile in weibo_file_list:
             type = eachFile.replace('-weibo.csv', '')
-            ids, predict_examples, publish_date, user_id = DataProcessor.get_test_examples(type)
-            predict_features = convert_examples_to_features(predict_examples, max_seq_length, tokenizer, False)
-            predict_data = features_to_tensor(predict_features)
-            predict_sampler = SequentialSampler(predict_data)
-            predict_dataloader = DataLoader(predict_data, sampler=predict_sampler, batch_size=args.predict_batch_size)
-            logger.info(" predict start ------------")
-            predictions, class_probas = do_predict(predict_dataloader, model, device)
-            logger.info(" predict finished ------------")
-            # print("len of prediction: " + str(len(predictions)) + "len of class probability: " + str(len(
-            # class_probas)))
-
-            eachFileResult = 'ClassificationResult-' + type + '-normal.csv'
-            writer = open(os.path.join(args.output_dir, eachFileResult), 'w', encoding='utf-8')
-            writer.write('ID,user_id,Text,Date,Expected\n')
-            for _id, label in zip(ids, predictions):
-                # print("id :"+ str(_id) + "prediction: " +str(predictions[_id]))
-                writer.write(str(_id) + ',' + str(user_id[_id]) + ',' + str(predict_examples[_id].sentence.replace(',', '，'))
-                             + ',' + str(publish_date[_id]) + ',' + str(label) + '\n')
-            writer.close()
+            predict_file(type, model, tokenizer, max_seq_length, device, args)
 
 
 if __name__ == "__main__":